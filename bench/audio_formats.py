@@ -0,0 +1,186 @@
+#!/usr/bin/env python3
+"""
+Audio Format Benchmark
+
+Compares message audio formats on what matters for the postbox: bytes
+transferred, download time over a (throttled) Wi-Fi link, and the CPU it takes
+to decode the file.
+
+For each fixture (test_cello.mp3 and test.wav by default) the file itself is
+measured, plus, when ffmpeg is installed, transcodes to WAV, MP3 and Opus at
+music and voice bitrates. Every variant is downloaded through
+http_checker.download_mp3 from a local stand-in API that answers with the
+variant's Content-Type, then decoded with the device's decoder for the format
+(falling back to ffmpeg). Missing tools are reported and skipped. The results
+are printed as JSON:
+
+    python3 -m bench.audio_formats --bandwidth 256 --output formats.json
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import resource
+import tempfile
+import contextlib
+import subprocess
+
+from bench import fakes
+
+FIXTURES = (fakes.DEFAULT_AUDIO_FIXTURE, os.path.join(fakes.REPO_DIR, "test.wav"))
+
+# name -> (format, ffmpeg output arguments)
+VARIANTS = {
+    "wav": ("wav", ["-c:a", "pcm_s16le"]),
+    "mp3_128k": ("mp3", ["-c:a", "libmp3lame", "-b:a", "128k"]),
+    "mp3_voice_32k": ("mp3", ["-c:a", "libmp3lame", "-ac", "1", "-b:a", "32k"]),
+    "opus_64k": ("opus", ["-c:a", "libopus", "-b:a", "64k"]),
+    "opus_voice_24k": ("opus", ["-c:a", "libopus", "-ac", "1", "-b:a", "24k", "-application", "voip"]),
+}
+
+# Decode to nowhere with the tools the player uses, so only decoding is measured.
+DECODERS = {
+    "mp3": ["mpg321", "-q", "-w", "/dev/null"],
+    "opus": ["opusdec", "--quiet"],
+    "wav": None,  # Played as is.
+}
+
+
+def transcode(source, name, work_dir):
+    """Encode source as the named variant with ffmpeg. Returns the new path, or None if that failed."""
+    from scripts import audio_formats
+
+    fmt, codec_args = VARIANTS[name]
+    base = os.path.splitext(os.path.basename(source))[0]
+    path = os.path.join(work_dir, f"{base}.{name}{audio_formats.extension(fmt)}")
+    result = subprocess.run(
+        ["ffmpeg", "-v", "error", "-y", "-i", source, "-vn", *codec_args, path],
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.PIPE,
+    )
+    if result.returncode != 0:
+        print(f"Skipping {name} for {source}: {result.stderr.decode(errors='replace').strip()}", file=sys.stderr)
+        return None
+    return path
+
+
+def decode_command(path, fmt):
+    """Return (decoder name, command) to decode path without playing it, or (None, None) if no decoder is installed."""
+    if fmt == "wav":
+        return "none", None
+    command = DECODERS.get(fmt)
+    if command and shutil.which(command[0]):
+        if fmt == "opus":
+            return command[0], command + [path, "/dev/null"]
+        return command[0], command + [path]
+    if shutil.which("ffmpeg"):
+        return "ffmpeg", ["ffmpeg", "-v", "error", "-i", path, "-f", "null", "-"]
+    return None, None
+
+
+def measure_decode(path, fmt, repeat):
+    """Decode path repeat times and return the mean CPU and wall time per decode."""
+    decoder, command = decode_command(path, fmt)
+    if command is None:
+        return {"decoder": decoder, "cpu_seconds": 0.0 if decoder else None, "wall_seconds": 0.0 if decoder else None}
+    before = resource.getrusage(resource.RUSAGE_CHILDREN)
+    start = time.perf_counter()
+    for _ in range(repeat):
+        subprocess.run(command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True)
+    wall = time.perf_counter() - start
+    after = resource.getrusage(resource.RUSAGE_CHILDREN)
+    cpu = (after.ru_utime - before.ru_utime) + (after.ru_stime - before.ru_stime)
+    return {"decoder": decoder, "cpu_seconds": round(cpu / repeat, 4), "wall_seconds": round(wall / repeat, 4)}
+
+
+def measure_download(path, bandwidth, repeat):
+    """
+    Serve path from a stand-in API and download it repeat times through the
+    HTTP checker. Returns the bytes transferred, the mean download time and the
+    format the download was archived as.
+    """
+    from scripts import audio_formats, http_checker
+
+    api = fakes.FakeApiServer(fakes.FakeNetwork(), message_count=1, audio_path=path, bytes_per_second=bandwidth * 1024)
+    api.start()
+    try:
+        durations = []
+        local_path = None
+        for i in range(repeat):
+            start = time.perf_counter()
+            local_path = http_checker.download_mp3(f"{api.url}/media/1.mp3", f"bench-{i}")
+            durations.append(time.perf_counter() - start)
+        if local_path is None:
+            raise RuntimeError(f"Download of {path} failed")
+        return {
+            "bytes": len(api.audio),
+            "download_seconds": round(sum(durations) / len(durations), 4),
+            "content_type": api.audio_content_type,
+            "stored_as": audio_formats.format_for_path(local_path),
+        }
+    finally:
+        api.stop()
+
+
+def run(args):
+    work_dir = tempfile.mkdtemp(prefix="vivi_formats_")
+    os.environ["VIVI_METRICS_DIR"] = os.path.join(work_dir, "metrics")
+    os.environ["VIVI_TRACE_FILE"] = os.path.join(work_dir, "traces.jsonl")
+
+    from scripts import audio_formats, message_archive
+    message_archive.DOWNLOAD_DIR = os.path.join(work_dir, "downloads")
+
+    has_ffmpeg = shutil.which("ffmpeg") is not None
+    if not has_ffmpeg:
+        print("ffmpeg not found; only measuring the fixtures as they are.", file=sys.stderr)
+
+    results = []
+    for fixture in args.fixtures:
+        variants = {"original": fixture}
+        if has_ffmpeg:
+            for name in VARIANTS:
+                path = transcode(fixture, name, work_dir)
+                if path:
+                    variants[name] = path
+        original_bytes = os.path.getsize(fixture)
+        for name, path in variants.items():
+            fmt = audio_formats.format_for_path(path)
+            result = {"fixture": os.path.basename(fixture), "variant": name, "format": fmt}
+            result.update(measure_download(path, args.bandwidth, args.repeat))
+            result["bytes_vs_original"] = round(result["bytes"] / original_bytes, 3)
+            result.update(measure_decode(path, fmt, args.repeat))
+            results.append(result)
+
+    return {
+        "config": vars(args),
+        "accept": audio_formats.accept_header(),
+        "tools": {tool: shutil.which(tool) is not None for tool in ("ffmpeg", "mpg321", "opusdec", "aplay")},
+        "results": results,
+        "work_dir": work_dir,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare bytes, download time and decode CPU of message audio formats as JSON.")
+    parser.add_argument("fixtures", nargs="*", default=list(FIXTURES), help="audio files to compare (default: the bundled fixtures)")
+    parser.add_argument("--bandwidth", type=float, default=256.0, help="throttle downloads to this many KiB/s (0 = unthrottled)")
+    parser.add_argument("--repeat", type=int, default=3, help="downloads and decodes per variant, averaged")
+    parser.add_argument("--output", help="write the JSON results to this file instead of stdout")
+    args = parser.parse_args()
+
+    # Keep the services' own output on stderr so stdout is just the JSON results.
+    with contextlib.redirect_stdout(sys.stderr):
+        results = run(args)
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,338 @@
+#!/usr/bin/env python3
+"""
+fakes.py - Hardware and network stand-ins for running the postbox services off the Pi.
+
+- FakePixelStrip: records every frame shown instead of driving the LED ring.
+- ScriptedButton: a hall sensor that "triggers" a fixed delay after it starts being watched.
+- FakeAudioSubprocess: replaces the player subprocess with a timed, silent playback.
+- FakeNetwork / FakePingSubprocess: a scripted, optionally flapping Wi-Fi link.
+- FakeApiServer: a local HTTP stand-in for the thinkkappi API, including its push channel,
+  optionally throttled to the bandwidth of a weak Wi-Fi link.
+"""
+
+import os
+import json
+import time
+import types
+import threading
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from scripts import audio_formats
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+DEFAULT_AUDIO_FIXTURE = os.path.join(REPO_DIR, "test_cello.mp3")
+
+
+def Color(r, g, b):
+    """Same packing as rpi_ws281x.Color."""
+    return (r << 16) | (g << 8) | b
+
+
+class FakePixelStrip:
+    """A PixelStrip that records frames instead of driving LEDs."""
+
+    def __init__(self, num, pin, freq_hz=800000, dma=10, invert=False, brightness=255, channel=0, keep_frames=100):
+        self.num = num
+        self.pixels = [0] * num
+        self.frames_shown = 0
+        self.recent_frames = deque(maxlen=keep_frames)
+        self.begun = False
+
+    def begin(self):
+        self.begun = True
+
+    def numPixels(self):
+        return self.num
+
+    def setPixelColor(self, i, color):
+        self.pixels[i] = color
+
+    def show(self):
+        self.frames_shown += 1
+        self.recent_frames.append((time.monotonic(), tuple(self.pixels)))
+
+
+class ScriptedButton:
+    """
+    A gpiozero.Button stand-in for the hall sensor. It reports a single press
+    trigger_delay seconds after is_pressed is first polled, which mimics a
+    recipient noticing the LED notification and opening the box.
+
+    If `armed` is set, the button only counts down (and presses) while it
+    returns True, e.g. while a message is pending.
+    """
+
+    trigger_delay = 0.5
+    armed = None
+
+    def __init__(self, pin, pull_up=True, **kwargs):
+        self.pin = pin
+        self.presses = 0
+        self._armed_at = None
+
+    @property
+    def is_pressed(self):
+        if self.armed is not None and not self.armed():
+            self._armed_at = None
+            return False
+        now = time.monotonic()
+        if self._armed_at is None:
+            self._armed_at = now
+        if now - self._armed_at >= self.trigger_delay:
+            self._armed_at = None
+            self.presses += 1
+            return True
+        return False
+
+
+class _FakePipe:
+    def close(self):
+        pass
+
+
+class _FakeProcess:
+    def __init__(self, sink, args, piped):
+        self.sink = sink
+        self.args = args
+        self.stdout = _FakePipe() if piped else None
+        self.returncode = None
+
+    def wait(self, timeout=None):
+        # Only the process producing the sound takes playback time. Sleep
+        # through the service's own time module so the harness can stop it.
+        if self.stdout is None and self.returncode is None:
+            self.sink.clock.sleep(self.sink.playback_seconds)
+        self.returncode = 0
+        return 0
+
+    def terminate(self):
+        self.returncode = -15
+
+
+class FakeAudioSubprocess:
+    """
+    Stands in for the subprocess module inside audio_player: every player
+    pipeline "plays" silently for playback_seconds (simulated time).
+    """
+
+    PIPE = -1
+
+    def __init__(self, clock, playback_seconds=2.0):
+        self.clock = clock
+        self.playback_seconds = playback_seconds
+        self.plays = []
+
+    def Popen(self, args, stdout=None, **kwargs):
+        piped = stdout == self.PIPE
+        if not piped:
+            self.plays.append(args)
+        return _FakeProcess(self, args, piped)
+
+
+class FakeNetwork:
+    """
+    A Wi-Fi link that is up for up_seconds, then down for down_seconds, repeating.
+    With down_seconds=0 the link never drops.
+    """
+
+    def __init__(self, up_seconds=0.0, down_seconds=0.0):
+        self.up_seconds = up_seconds
+        self.down_seconds = down_seconds
+        self.started_at = time.monotonic()
+
+    def is_up(self):
+        if not self.down_seconds:
+            return True
+        period = self.up_seconds + self.down_seconds
+        return (time.monotonic() - self.started_at) % period < self.up_seconds
+
+
+class FakePingSubprocess:
+    """
+    Stands in for the subprocess module inside wifi_manager: ping follows the
+    FakeNetwork, every other command (the captive portal scripts) is recorded
+    and succeeds.
+    """
+
+    CalledProcessError = Exception
+    DEVNULL = -3
+
+    def __init__(self, network):
+        self.network = network
+        self.commands = []
+
+    def run(self, args, **kwargs):
+        if args and args[0] == "ping":
+            return types.SimpleNamespace(returncode=0 if self.network.is_up() else 1)
+        self.commands.append(args)
+        return types.SimpleNamespace(returncode=0)
+
+
+class FakeApiServer:
+    """
+    A local stand-in for the thinkkappi API.
+
+    Messages are posted every post_interval seconds until message_count have
+    been posted. get_post returns the oldest unacknowledged message, the audio
+    is served from /media/<id>.mp3 (with the Content-Type of audio_path, like an
+    API that negotiated the format) and listen_post acknowledges a message.
+    While the FakeNetwork is down every request fails with 503. With
+    bytes_per_second set, audio downloads are throttled to that rate.
+
+    With push=True, /vivi/events streams a 'new_post' Server-Sent Event whenever
+    a new message becomes available, plus a keepalive every keepalive_interval
+    seconds, and drops the stream while the network is down. Without it the
+    endpoint answers 404, like an API without push support.
+    """
+
+    def __init__(self, network, message_count=20, post_interval=0.0, audio_path=DEFAULT_AUDIO_FIXTURE, nightlight=False,
+                 push=False, keepalive_interval=1.0, bytes_per_second=0):
+        self.network = network
+        self.bytes_per_second = bytes_per_second
+        self.push = push
+        self.keepalive_interval = keepalive_interval
+        self.stopped = False
+        self.message_count = message_count
+        self.post_interval = post_interval
+        self.nightlight = nightlight
+        with open(audio_path, "rb") as f:
+            self.audio = f.read()
+        self.audio_content_type = audio_formats.FORMATS[audio_formats.format_for_path(audio_path)]["content_types"][0]
+        # The Accept header of the most recent audio download.
+        self.audio_accept = None
+        self.posted_at = {}
+        self.acked_at = {}
+        self.requests = 0
+        self.failed_requests = 0
+        self.bytes_sent = 0
+        self.lock = threading.Lock()
+        self.started_at = None
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), self._handler_class())
+        self.server.daemon_threads = True
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    @property
+    def url(self):
+        host, port = self.server.server_address
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self.started_at = time.time()
+        self.thread.start()
+
+    def stop(self):
+        self.stopped = True
+        self.server.shutdown()
+        self.server.server_close()
+
+    def all_acked(self):
+        return len(self.acked_at) >= self.message_count
+
+    def _post_due_messages(self):
+        # Messages are numbered from 1; message n is posted (n - 1) * post_interval after start.
+        now = time.time()
+        for message_id in range(len(self.posted_at) + 1, self.message_count + 1):
+            due = self.started_at + (message_id - 1) * self.post_interval
+            if due > now:
+                break
+            self.posted_at[message_id] = due
+
+    def _next_post(self):
+        with self.lock:
+            self._post_due_messages()
+            for message_id in sorted(self.posted_at):
+                if message_id not in self.acked_at:
+                    return {"type": "audio", "id": message_id, "mp3_url": f"{self.url}/media/{message_id}.mp3"}
+        return {}
+
+    def _ack(self, message_id):
+        with self.lock:
+            if message_id in self.posted_at:
+                self.acked_at.setdefault(message_id, time.time())
+                return True
+        return False
+
+    def _handler_class(self):
+        api = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, format, *args):
+                pass
+
+            def _send(self, status, body, content_type="application/json", throttle=False):
+                if isinstance(body, (dict, list)):
+                    body = json.dumps(body).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                if throttle and api.bytes_per_second:
+                    # Send in 50 ms worth of bytes at a time.
+                    step = max(1, int(api.bytes_per_second / 20))
+                    for offset in range(0, len(body), step):
+                        chunk = body[offset:offset + step]
+                        self.wfile.write(chunk)
+                        time.sleep(len(chunk) / api.bytes_per_second)
+                else:
+                    self.wfile.write(body)
+                api.bytes_sent += len(body)
+
+            def _network_down(self):
+                api.requests += 1
+                if api.network.is_up():
+                    return False
+                api.failed_requests += 1
+                self._send(503, {"error": "network down"})
+                return True
+
+            def do_GET(self):
+                if self._network_down():
+                    return
+                if self.path == "/vivi/get_post":
+                    self._send(200, api._next_post())
+                elif self.path == "/vivi/nightlight":
+                    self._send(200, {"nightlight": api.nightlight})
+                elif self.path == "/vivi/events" and api.push:
+                    self._stream_events()
+                elif self.path.startswith("/media/"):
+                    api.audio_accept = self.headers.get("Accept")
+                    self._send(200, api.audio, api.audio_content_type, throttle=True)
+                else:
+                    self._send(404, {"error": "not found"})
+
+            def _stream_events(self):
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.end_headers()
+                announced = None
+                last_keepalive = 0.0
+                try:
+                    while not api.stopped and api.network.is_up():
+                        chunk = b""
+                        post = api._next_post()
+                        if post and post["id"] != announced:
+                            announced = post["id"]
+                            chunk += b"event: new_post\ndata: " + json.dumps({"id": announced}).encode() + b"\n\n"
+                        now = time.monotonic()
+                        if now - last_keepalive >= api.keepalive_interval:
+                            last_keepalive = now
+                            chunk += b": keepalive\n\n"
+                        if chunk:
+                            self.wfile.write(chunk)
+                            self.wfile.flush()
+                            api.bytes_sent += len(chunk)
+                        time.sleep(0.02)
+                except OSError:
+                    pass  # The client went away.
+
+            def do_DELETE(self):
+                if self._network_down():
+                    return
+                prefix = "/vivi/listen_post/"
+                if self.path.startswith(prefix) and self.path[len(prefix):].isdigit():
+                    if api._ack(int(self.path[len(prefix):])):
+                        self._send(200, {"ok": True})
+                        return
+                self._send(404, {"error": "not found"})
+
+        return Handler
@@ -0,0 +1,251 @@
+#!/usr/bin/env python3
+"""
+Benchmark and Soak-Test Harness
+
+Runs the real service loops (http_checker, audio_player, led_display and
+wifi_manager) in one process against the fakes in bench/fakes.py, so the whole
+postbox pipeline can be exercised without a Pi, LED ring, hall sensor or the
+thinkkappi API.
+
+Every service gets its own scaled clock: a sleep of N seconds in a service
+takes N * --time-scale seconds of wall time. The run ends once every posted
+message has been acknowledged (or after --timeout seconds), and the results
+are printed as JSON:
+
+    python3 -m bench.harness --messages 500 --flap-up 60 --flap-down 40 --output results.json
+"""
+
+import os
+import sys
+import json
+import time
+import types
+import argparse
+import tempfile
+import contextlib
+import threading
+
+from bench import fakes
+
+SERVICES = ("http_checker", "audio_player", "led_display", "wifi_manager")
+
+
+class _StopService(BaseException):
+    """Raised from a service's sleep once the harness is shutting down."""
+
+
+class ServiceClock:
+    """
+    A drop-in for the time module inside one service. Sleeps are scaled and
+    raise _StopService once the harness is stopping; everything else is
+    delegated to the real time module.
+    """
+
+    def __init__(self, scale, stop_event):
+        self.scale = scale
+        self.stop_event = stop_event
+
+    def sleep(self, seconds):
+        if self.stop_event.wait(seconds * self.scale):
+            raise _StopService()
+
+    def __getattr__(self, name):
+        return getattr(time, name)
+
+
+def install_fake_hardware():
+    """Register fake rpi_ws281x and gpiozero modules before the services import them."""
+    rpi_ws281x = types.ModuleType("rpi_ws281x")
+    rpi_ws281x.PixelStrip = fakes.FakePixelStrip
+    rpi_ws281x.Color = fakes.Color
+    sys.modules["rpi_ws281x"] = rpi_ws281x
+
+    gpiozero = types.ModuleType("gpiozero")
+    gpiozero.Button = fakes.ScriptedButton
+    sys.modules["gpiozero"] = gpiozero
+
+
+def message_pending(state_management):
+    """Read the pending flag straight from the state file, bypassing the I/O metrics."""
+    try:
+        return state_management._read_json(state_management.STATE_FILE).get("message_pending", False)
+    except Exception:
+        return False
+
+
+def latency_summary(values):
+    if not values:
+        return {}
+    ordered = sorted(values)
+
+    def pct(p):
+        return round(ordered[max(1, -(-p * len(ordered) // 100)) - 1], 4)
+
+    return {"count": len(ordered), "p50": pct(50), "p90": pct(90), "p99": pct(99), "max": round(ordered[-1], 4)}
+
+
+def run(args):
+    work_dir = tempfile.mkdtemp(prefix="vivi_bench_")
+    # The monitoring modules read these at import time.
+    # No textfiles are written (see below); this only keeps any stray write in the work dir.
+    os.environ["VIVI_METRICS_DIR"] = os.path.join(work_dir, "metrics")
+    os.environ["VIVI_TRACE_FILE"] = os.path.join(work_dir, "traces.jsonl")
+    install_fake_hardware()
+
+    from monitoring import metrics, tracing
+    # All services share one registry in this process, and each main() renames
+    # it with set_service(), so per-service textfiles would carry the wrong
+    # service. The harness reports from the registry directly instead.
+    metrics.registry.flush = lambda force=False: None
+    from state_management import state_management
+    state_management.STATE_FILE = os.path.join(work_dir, "run", "state.json")
+    state_management.DURABLE_STATE_FILE = os.path.join(work_dir, "durable", "state.json")
+
+    from scripts import http_checker, audio_player, led_display, wifi_manager, push_channel, message_archive
+    modules = {
+        "http_checker": http_checker,
+        "audio_player": audio_player,
+        "led_display": led_display,
+        "wifi_manager": wifi_manager,
+    }
+
+    stop_event = threading.Event()
+    clocks = {name: ServiceClock(args.time_scale, stop_event) for name in SERVICES}
+    for name, module in modules.items():
+        module.time = clocks[name]
+
+    network = fakes.FakeNetwork(args.flap_up * args.time_scale, args.flap_down * args.time_scale)
+    api = fakes.FakeApiServer(
+        network,
+        message_count=args.messages,
+        post_interval=args.post_interval * args.time_scale,
+        audio_path=args.audio,
+        push=args.push,
+        bytes_per_second=args.bandwidth * 1024,
+    )
+    http_checker.GET_POST_ENDPOINT = f"{api.url}/vivi/get_post"
+    http_checker.NIGHTLIGHT_ENDPOINT = f"{api.url}/vivi/nightlight"
+    http_checker.LISTEN_POST_ENDPOINT = f"{api.url}/vivi/listen_post/{{message_id}}"
+    http_checker.PUSH_ENDPOINT = f"{api.url}/vivi/events"
+    message_archive.DOWNLOAD_DIR = os.path.join(work_dir, "downloads")
+
+    audio_sink = fakes.FakeAudioSubprocess(clocks["audio_player"], playback_seconds=args.playback_seconds)
+    audio_player.subprocess = audio_sink
+    fakes.ScriptedButton.trigger_delay = args.trigger_delay * args.time_scale
+    fakes.ScriptedButton.armed = staticmethod(lambda: message_pending(state_management))
+
+    ping = fakes.FakePingSubprocess(network)
+    wifi_manager.subprocess = ping
+
+    services = {}
+
+    def run_service(name):
+        result = services[name]
+        try:
+            modules[name].main()
+        except _StopService:
+            pass
+        except Exception as e:
+            result["error"] = f"{type(e).__name__}: {e}"
+        result["cpu_seconds"] = round(time.thread_time(), 4)
+
+    threads = []
+    for name in SERVICES:
+        services[name] = {}
+        threads.append(threading.Thread(target=run_service, args=(name,), name=name, daemon=True))
+
+    api.start()
+    started_at = time.perf_counter()
+    cpu_started_at = time.process_time()
+    for thread in threads:
+        thread.start()
+    while not api.all_acked() and time.perf_counter() - started_at < args.timeout:
+        if not all(thread.is_alive() for thread in threads):
+            break
+        time.sleep(0.1)
+    stop_event.set()
+    for thread in threads:
+        thread.join(timeout=10)
+    duration = time.perf_counter() - started_at
+    process_cpu = time.process_time() - cpu_started_at
+    api.stop()
+
+    for result in services.values():
+        if "cpu_seconds" in result:
+            result["cpu_percent"] = round(100 * result["cpu_seconds"] / duration, 2)
+
+    e2e = [api.acked_at[i] - api.posted_at[i] for i in api.acked_at]
+    stages = tracing.stage_durations(tracing.load_traces(tracing.TRACE_FILE))
+    state_io = state_management.STATE_IO_LATENCY
+
+    return {
+        "config": vars(args),
+        "duration_seconds": round(duration, 3),
+        "process_cpu_seconds": round(process_cpu, 3),
+        "services": services,
+        "messages": {
+            "posted": len(api.posted_at),
+            "acked": len(api.acked_at),
+            "end_to_end_seconds": latency_summary(e2e),
+            "stages_seconds": {name: latency_summary(values) for name, values in stages.items() if values},
+        },
+        "led": {
+            "frames_rendered": led_display.strip.frames_shown,
+            "frame_overruns": led_display.FRAME_OVERRUNS.get(),
+        },
+        "state_io": {
+            "reads": state_io.count(op="read"),
+            "writes": state_io.count(op="write"),
+            "durable_checkpoints": state_io.count(op="checkpoint"),
+            "errors": sum(state_management.STATE_IO_ERRORS.values.values()),
+        },
+        "api": {
+            "requests": api.requests,
+            "failed_requests": api.failed_requests,
+            "bytes_sent": api.bytes_sent,
+        },
+        "push": {
+            "connects": push_channel.PUSH_CONNECTS.get(result="ok"),
+            "failed_connects": push_channel.PUSH_CONNECTS.get(result="error"),
+            "events": sum(push_channel.PUSH_EVENTS.values.values()),
+        },
+        "audio": {
+            "plays": len(audio_sink.plays),
+            "hall_triggers": audio_player.hall_sensor.presses if audio_player.hall_sensor else 0,
+            "content_type": api.audio_content_type,
+            "accept": api.audio_accept,
+        },
+        "wifi": {"captive_portal_commands": len(ping.commands)},
+        "work_dir": work_dir,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the postbox services against fakes and report performance as JSON.")
+    parser.add_argument("--messages", type=int, default=20, help="number of messages to post")
+    parser.add_argument("--post-interval", type=float, default=0.0, help="simulated seconds between posts (0 = all at once)")
+    parser.add_argument("--playback-seconds", type=float, default=2.0, help="simulated length of each message")
+    parser.add_argument("--trigger-delay", type=float, default=3.0, help="simulated seconds until the recipient opens the box")
+    parser.add_argument("--flap-up", type=float, default=0.0, help="simulated seconds the Wi-Fi stays up per flap cycle")
+    parser.add_argument("--flap-down", type=float, default=0.0, help="simulated seconds the Wi-Fi stays down per flap cycle (0 = never)")
+    parser.add_argument("--push", action="store_true", help="serve the push channel (otherwise the services fall back to polling)")
+    parser.add_argument("--time-scale", type=float, default=0.1, help="wall seconds per simulated second")
+    parser.add_argument("--timeout", type=float, default=600.0, help="wall-clock limit for the run in seconds")
+    parser.add_argument("--audio", default=fakes.DEFAULT_AUDIO_FIXTURE, help="audio file served for every message")
+    parser.add_argument("--bandwidth", type=float, default=0.0, help="throttle audio downloads to this many KiB/s (0 = unthrottled)")
+    parser.add_argument("--output", help="write the JSON results to this file instead of stdout")
+    args = parser.parse_args()
+
+    # Keep the services' own output on stderr so stdout is just the JSON results.
+    with contextlib.redirect_stdout(sys.stderr):
+        results = run(args)
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
@@ -12,33 +12,20 @@ import os
 import subprocess
 import time
 import sys
-import logging
 from flask import Flask, render_template, request, redirect, url_for
 
-# Create a logger for the application
-logger = logging.getLogger('captive_portal')
-logger.setLevel(logging.DEBUG)
+# This script is started directly (not with -m), so make the repository root importable.
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), ".."))
+from monitoring.logs import get_logger, kv
 
-# Create handlers: one for file, one for console (if desired)
-file_handler = logging.FileHandler('/var/log/captive_portal.log')
-file_handler.setLevel(logging.DEBUG)
-console_handler = logging.StreamHandler()
+# Buffered, rate-limited logger shared with the other services; batches are also
+# appended to the portal's own log file.
+logger = get_logger("captive_portal", logfile="/var/log/captive_portal.log")
 
-# Create a logging format and add it to the handlers
-formatter = logging.Formatter('%(asctime)s [%(levelname)s] %(message)s')
-file_handler.setFormatter(formatter)
-console_handler.setFormatter(formatter)
-
-# Add handlers to the logger
-logger.addHandler(file_handler)
-logger.addHandler(console_handler)
-
-# Now create the Flask app and attach the logger
+# Now create the Flask app and route its logger through ours
 app = Flask(__name__)
-app.logger.handlers = []  # Remove default handlers
-app.logger.propagate = True  # Ensure logs propagate to our logger
-app.logger.addHandler(file_handler)
-app.logger.setLevel(logging.DEBUG)
+app.logger.handlers = list(logger.parent.handlers)  # Replace Flask's default handlers with ours
+app.logger.propagate = False
 logger.debug("Custom logger initialized.")
 
 # The path to the shell script that reverts AP mode to client mode
@@ -53,9 +40,9 @@ def revert_to_client_mode():
     """
     try:
         subprocess.run(["/bin/bash", REVERT_SCRIPT], check=True)
-        app.logger.info("Reverted to client mode using the shell script.")
+        logger.info("Reverted to client mode using the shell script.")
     except Exception as e:
-        app.logger.error("Error reverting to client mode:", e)
+        logger.error("Error reverting to client mode", extra=kv(error=e))
         raise e
 
 def open_captive_portal():
@@ -64,9 +51,9 @@ def open_captive_portal():
     """
     try:
         subprocess.run(["/bin/bash", CAPTIVE_PORTAL_SCRIPT], check=True)
-        app.logger.info("Opened captive portal using script.")
+        logger.info("Opened captive portal using script.")
     except Exception as e:
-        app.logger.error("Error opening captive portal:", e)
+        logger.error("Error opening captive portal", extra=kv(error=e))
         raise e
 
 def update_nm_connection(ssid, password):
@@ -85,9 +72,9 @@ def update_nm_connection(ssid, password):
 
         try:
             subprocess.run(["nmcli", "connection", "delete", ssid], check=True, env=env)
-            app.logger.info(f"Removed old connection to {ssid}.")
+            logger.info("Removed old connection", extra=kv(ssid=ssid))
         except Exception as e:
-            app.logger.warning("Didn't remove an existing connection")
+            logger.warning("Didn't remove an existing connection")
 
         time.sleep(4)
         # Create a new connection
@@ -95,15 +82,17 @@ def update_nm_connection(ssid, password):
             ["/usr/bin/nmcli", "device", "wifi", "connect", ssid, "password", password],
             check=False, capture_output=True, text=True,  env=env
         )
-        app.logger.info(f"nmcli stdout: {result.stdout}")
-        app.logger.error(f"nmcli stderr: {result.stderr}")
+        logger.info(
+            "nmcli finished",
+            extra=kv(returncode=result.returncode, stdout=result.stdout.strip(), stderr=result.stderr.strip()),
+        )
         if result.returncode != 0:
             raise Exception(f"nmcli returned non-zero exit code {result.returncode}")
-        app.logger.info(f"Created new NetworkManager profile for {ssid}.")
+        logger.info("Created new NetworkManager profile", extra=kv(ssid=ssid))
     except Exception as e:
-        app.logger.error("Error updating NetworkManager connection:", exc_info=e)
+        logger.error("Error updating NetworkManager connection", exc_info=e)
         open_captive_portal()
-        app.logger.info("Opened Captive Portal again")
+        logger.info("Opened Captive Portal again")
         raise e
 
 
@@ -113,7 +102,7 @@ def test_connectivity():
     Returns True if successful, False otherwise.
     """
     time.sleep(5)
-    app.logger.info("Waited for recconect, testing connection.")
+    logger.info("Waited for recconect, testing connection.")
     try:
         result = subprocess.run(
             ["ping", "-c", "1", "8.8.8.8"],
@@ -122,7 +111,7 @@ def test_connectivity():
         )
         return result.returncode == 0
     except Exception as e:
-        app.logger.error("Error during connectivity test:", e)
+        logger.error("Error during connectivity test", extra=kv(error=e))
         return False
 
 
@@ -140,21 +129,20 @@ def update_and_connect(ssid, password):
         else:
             return "fail"
     except Exception as e:
-        app.logger.error("Exception during update and connect:", e)
+        logger.error("Exception during update and connect", extra=kv(error=e))
         return "fail"
 
 
 @app.route("/", methods=["GET", "POST"])
 def portal():
-    print("request received", flush=True)
-    app.logger.info("Received a request to / with method: %s", request.method)
+    logger.info("Received a request to /", extra=kv(method=request.method))
     if request.method == "POST":
-        print("POST received", flush=True)
         ssid = request.form.get("ssid")
         password = request.form.get("password")
-        app.logger.info(f"Received new credentials: SSID={ssid}, Password={password}")
+        # Never log the password itself.
+        logger.info("Received new credentials", extra=kv(ssid=ssid, password_set=bool(password)))
         outcome = update_and_connect(ssid, password)
-        app.logger.info(f"Result is {outcome}")
+        logger.info("Credentials applied", extra=kv(outcome=outcome))
         return redirect(url_for("result", outcome=outcome))
     return render_template("portal.html")
 
@@ -176,5 +164,5 @@ def page_not_found(e):
 
 
 if __name__ == "__main__":
-    app.logger.info("Captive portal app has begun!!")
+    logger.info("Captive portal app has begun!!")
     app.run(host="0.0.0.0", port=80)
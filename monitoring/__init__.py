@@ -0,0 +1,9 @@
+import os
+import tempfile
+
+# Runtime directory for live state, metrics, traces and log dumps. /run is a
+# tmpfs on the Pi, so frequent rewrites never touch the SD card.
+RUNTIME_DIR = os.environ.get(
+    "VIVI_RUNTIME_DIR",
+    "/run/vivi_postbox" if os.path.isdir("/run") else os.path.join(tempfile.gettempdir(), "vivi_postbox"),
+)
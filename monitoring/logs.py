@@ -0,0 +1,237 @@
+#!/usr/bin/env python3
+"""
+logs.py - Buffered, rate-limited structured logging for the postbox services.
+
+Every service calls get_logger() once and logs through the standard logging
+module. Records are:
+
+- kept in an in-memory ring buffer (all levels, including DEBUG), which can be
+  dumped on demand by sending the process SIGUSR1, e.g.
+  `systemctl kill -s USR1 http_checker`;
+- rate limited: after RATE_LIMIT_BURST identical messages within
+  RATE_LIMIT_WINDOW_SECONDS, further copies are dropped and later summarised as
+  'message "..." repeated N times';
+- formatted as key=value (or JSON, with VIVI_LOG_FORMAT=json) lines;
+- written in batches from a background thread, so service loops never block on
+  stderr/journald. WARNING and above are written without waiting for the batch.
+
+Extra structured fields are passed with kv():
+
+    log.info("Downloaded MP3", extra=kv(path=local_path, bytes=size))
+"""
+
+import os
+import sys
+import json
+import time
+import queue
+import atexit
+import signal
+import logging
+import threading
+from collections import deque
+
+from monitoring import RUNTIME_DIR
+
+ROOT_LOGGER = "vivi"
+LOG_LEVEL = os.environ.get("VIVI_LOG_LEVEL", "INFO").upper()
+LOG_FORMAT = os.environ.get("VIVI_LOG_FORMAT", "kv")
+DUMP_DIR = os.environ.get("VIVI_LOG_DUMP_DIR", os.path.join(RUNTIME_DIR, "logs"))
+
+RING_BUFFER_RECORDS = 1000
+BATCH_SIZE = 50
+FLUSH_INTERVAL_SECONDS = 2.0
+RATE_LIMIT_BURST = 3
+RATE_LIMIT_WINDOW_SECONDS = 3600
+# Forget rate limit state for at most this many distinct messages.
+RATE_LIMIT_MAX_KEYS = 256
+
+_configured = {}
+
+
+def kv(**fields):
+    """Structured fields for a log call: log.info("...", extra=kv(key=value))."""
+    return {"fields": fields}
+
+
+class StructuredFormatter(logging.Formatter):
+    """Formats records as key=value pairs, or as one JSON object per line."""
+
+    def __init__(self, as_json=False):
+        super().__init__()
+        self.as_json = as_json
+
+    def format(self, record):
+        item = {
+            "ts": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(record.created)) + f".{int(record.msecs):03d}",
+            "level": record.levelname,
+            "logger": record.name[len(ROOT_LOGGER) + 1:] if record.name.startswith(ROOT_LOGGER + ".") else record.name,
+            "msg": record.getMessage(),
+        }
+        item.update(getattr(record, "fields", None) or {})
+        if record.exc_info:
+            item["exc"] = self.formatException(record.exc_info)
+        if self.as_json:
+            return json.dumps(item, default=str)
+        return " ".join(f"{key}={self._quote(value)}" for key, value in item.items())
+
+    @staticmethod
+    def _quote(value):
+        text = str(value)
+        if not text or any(c in text for c in ' "=\n'):
+            return json.dumps(text)
+        return text
+
+
+class RingBufferHandler(logging.Handler):
+    """Keeps the most recent records in memory for on-demand dumps."""
+
+    def __init__(self, capacity=RING_BUFFER_RECORDS):
+        super().__init__(logging.DEBUG)
+        self.records = deque(maxlen=capacity)
+
+    def emit(self, record):
+        self.records.append(record)
+
+    def dump(self, path):
+        """Write the buffered records to path and return the number written."""
+        records = list(self.records)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "w") as f:
+            for record in records:
+                f.write(self.format(record) + "\n")
+        return len(records)
+
+
+class BatchingHandler(logging.Handler):
+    """
+    Hands records to a background thread, which rate limits them and writes
+    them to the target stream (and optional log file) in batches.
+    """
+
+    def __init__(self, stream, logfile=None, level=logging.INFO):
+        super().__init__(level)
+        self.stream = stream
+        self.logfile = logfile
+        self.queue = queue.Queue()
+        # message key -> [window start, count in window, suppressed count, sample record]
+        self.seen = {}
+        self.thread = threading.Thread(target=self._run, name="log-writer", daemon=True)
+        self.thread.start()
+
+    def emit(self, record):
+        self.queue.put(record)
+
+    def close(self):
+        self.queue.put(None)
+        self.thread.join(timeout=5)
+        super().close()
+
+    def _allow(self, record, now, out):
+        key = (record.levelno, record.name, record.getMessage(), repr(getattr(record, "fields", None)))
+        entry = self.seen.get(key)
+        if entry is None or now - entry[0] >= RATE_LIMIT_WINDOW_SECONDS:
+            if entry is not None and entry[2]:
+                out.append(self._repeated(entry))
+            if len(self.seen) >= RATE_LIMIT_MAX_KEYS:
+                self._expire(now, out, force=True)
+            self.seen[key] = [now, 1, 0, record]
+            return True
+        entry[1] += 1
+        if entry[1] <= RATE_LIMIT_BURST:
+            return True
+        entry[2] += 1
+        return False
+
+    def _expire(self, now, out, force=False):
+        """Summarise and forget messages whose rate limit window has ended."""
+        for key, entry in list(self.seen.items()):
+            if force or now - entry[0] >= RATE_LIMIT_WINDOW_SECONDS:
+                if entry[2]:
+                    out.append(self._repeated(entry))
+                del self.seen[key]
+
+    @staticmethod
+    def _repeated(entry):
+        sample = entry[3]
+        record = logging.LogRecord(
+            sample.name, sample.levelno, sample.pathname, sample.lineno,
+            'message "%s" repeated %d times', (sample.getMessage(), entry[2]), None,
+        )
+        return record
+
+    def _write(self, records):
+        if not records:
+            return
+        text = "".join(self.format(record) + "\n" for record in records)
+        try:
+            self.stream.write(text)
+            self.stream.flush()
+            if self.logfile:
+                with open(self.logfile, "a") as f:
+                    f.write(text)
+        except Exception:
+            pass  # Nowhere left to report logging failures.
+
+    def _run(self):
+        batch = []
+        last_flush = time.monotonic()
+        while True:
+            try:
+                record = self.queue.get(timeout=FLUSH_INTERVAL_SECONDS)
+            except queue.Empty:
+                record = False
+            now = time.monotonic()
+            if record is None:
+                self._expire(now, batch, force=True)
+                self._write(batch)
+                return
+            urgent = False
+            if record is not False and self._allow(record, time.time(), batch):
+                batch.append(record)
+                urgent = record.levelno >= logging.WARNING
+            if urgent or len(batch) >= BATCH_SIZE or now - last_flush >= FLUSH_INTERVAL_SECONDS:
+                self._expire(time.time(), batch)
+                self._write(batch)
+                batch = []
+                last_flush = now
+
+
+def dump(service=None):
+    """Write the in-memory ring buffer to DUMP_DIR/<service>.log and return the path."""
+    service = service or next(iter(_configured), "vivi")
+    ring = _configured[service]["ring"]
+    path = os.path.join(DUMP_DIR, f"{service}.log")
+    count = ring.dump(path)
+    logging.getLogger(ROOT_LOGGER).info("Dumped log buffer", extra=kv(records=count, path=path))
+    return path
+
+
+def get_logger(service, logfile=None):
+    """
+    Return the logger for a service, setting up the shared handlers on the
+    first call in this process.
+
+    Args:
+        service (str): The service name, used as the logger name and dump file name.
+        logfile (str): Optional file that batches are also appended to.
+    """
+    root = logging.getLogger(ROOT_LOGGER)
+    if not _configured:
+        formatter = StructuredFormatter(as_json=LOG_FORMAT == "json")
+        ring = RingBufferHandler()
+        ring.setFormatter(formatter)
+        writer = BatchingHandler(sys.stderr, logfile=logfile, level=getattr(logging, LOG_LEVEL, logging.INFO))
+        writer.setFormatter(formatter)
+        root.setLevel(logging.DEBUG)
+        root.addHandler(ring)
+        root.addHandler(writer)
+        root.propagate = False
+        atexit.register(writer.close)
+        if threading.current_thread() is threading.main_thread() and hasattr(signal, "SIGUSR1"):
+            # Dump from a separate thread, so the handler never re-enters a logging lock.
+            signal.signal(signal.SIGUSR1, lambda signum, frame: threading.Thread(target=dump, args=(service,)).start())
+        _configured[service] = {"ring": ring, "writer": writer}
+    elif service not in _configured:
+        _configured[service] = next(iter(_configured.values()))
+    return logging.getLogger(f"{ROOT_LOGGER}.{service}")
@@ -0,0 +1,236 @@
+#!/usr/bin/env python3
+"""
+metrics.py - Low-overhead, in-process metrics for the postbox services.
+
+Each service keeps a small registry of counters, gauges and fixed-bucket
+histograms. Recording a sample is a dict lookup and an addition, so it is cheap
+enough to call from inside the LED frame loop.
+
+The registry is periodically written out as a Prometheus textfile
+(METRICS_DIR/<service>.prom), which node_exporter's textfile collector can pick
+up. Running this module directly prints every service's current metrics:
+
+    python3 -m monitoring.metrics
+"""
+
+import os
+import sys
+import time
+import logging
+import threading
+
+from monitoring import RUNTIME_DIR
+from monitoring.logs import kv
+
+# Where the per-service .prom files are written, on tmpfs.
+METRICS_DIR = os.environ.get("VIVI_METRICS_DIR", os.path.join(RUNTIME_DIR, "metrics"))
+# Minimum number of seconds between two textfile writes.
+FLUSH_INTERVAL_SECONDS = 10
+
+log = logging.getLogger("vivi.metrics")
+
+# Default histogram buckets (seconds), tuned for the latencies seen on the Pi:
+# from sub-millisecond state reads up to multi-second downloads.
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+def _label_key(labels):
+    return tuple(sorted(labels.items())) if labels else ()
+
+
+def _format_labels(key, *extra):
+    pairs = list(key) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{value}"' for name, value in pairs) + "}"
+
+
+class Counter:
+    """A monotonically increasing value, optionally split by labels."""
+
+    kind = "counter"
+
+    def __init__(self, name, help_text):
+        self.name = name
+        self.help_text = help_text
+        self.values = {}
+
+    def inc(self, amount=1, **labels):
+        key = _label_key(labels)
+        self.values[key] = self.values.get(key, 0) + amount
+
+    def get(self, **labels):
+        return self.values.get(_label_key(labels), 0)
+
+    def render(self, const_labels=()):
+        return [f"{self.name}{_format_labels(key, *const_labels)} {value}" for key, value in self.values.items()]
+
+
+class Gauge(Counter):
+    """A value that can go up and down."""
+
+    kind = "gauge"
+
+    def set(self, value, **labels):
+        self.values[_label_key(labels)] = value
+
+
+class Histogram:
+    """A fixed-bucket histogram, rendered in the Prometheus cumulative format."""
+
+    kind = "histogram"
+
+    def __init__(self, name, help_text, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.buckets = tuple(buckets)
+        # label key -> [bucket counts..., +Inf count, sum]
+        self.values = {}
+
+    def observe(self, value, **labels):
+        key = _label_key(labels)
+        series = self.values.get(key)
+        if series is None:
+            series = self.values[key] = [0] * (len(self.buckets) + 1) + [0.0]
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                series[i] += 1
+                break
+        else:
+            series[len(self.buckets)] += 1
+        series[-1] += value
+
+    def time(self, **labels):
+        """Return a context manager that observes the elapsed time of its block."""
+        return _Timer(self, labels)
+
+    def count(self, **labels):
+        series = self.values.get(_label_key(labels))
+        return sum(series[:-1]) if series else 0
+
+    def render(self, const_labels=()):
+        lines = []
+        for key, series in self.values.items():
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, series):
+                cumulative += bucket_count
+                lines.append(f"{self.name}_bucket{_format_labels(key, *const_labels, ('le', bound))} {cumulative}")
+            cumulative += series[len(self.buckets)]
+            lines.append(f"{self.name}_bucket{_format_labels(key, *const_labels, ('le', '+Inf'))} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(key, *const_labels)} {series[-1]}")
+            lines.append(f"{self.name}_count{_format_labels(key, *const_labels)} {cumulative}")
+        return lines
+
+
+class _Timer:
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.elapsed = time.perf_counter() - self.start
+        self.histogram.observe(self.elapsed, **self.labels)
+        return False
+
+
+class Registry:
+    """Holds the metrics of one service and writes them out as a textfile."""
+
+    def __init__(self):
+        self.service = os.path.splitext(os.path.basename(sys.argv[0] or "python"))[0]
+        self.metrics = {}
+        self.last_flush = 0.0
+        self.lock = threading.Lock()
+
+    def _get(self, cls, name, help_text, **kwargs):
+        metric = self.metrics.get(name)
+        if metric is None:
+            with self.lock:
+                metric = self.metrics.setdefault(name, cls(name, help_text, **kwargs))
+        return metric
+
+    def counter(self, name, help_text=""):
+        return self._get(Counter, name, help_text)
+
+    def gauge(self, name, help_text=""):
+        return self._get(Gauge, name, help_text)
+
+    def histogram(self, name, help_text="", buckets=DEFAULT_BUCKETS):
+        return self._get(Histogram, name, help_text, buckets=buckets)
+
+    def render(self):
+        """
+        Return the whole registry in the Prometheus text exposition format.
+        Every sample carries a service label, so the textfiles of different
+        services never collide in node_exporter.
+        """
+        const_labels = (("service", self.service),)
+        lines = []
+        for metric in list(self.metrics.values()):
+            if metric.help_text:
+                lines.append(f"# HELP {metric.name} {metric.help_text}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.render(const_labels))
+        return "\n".join(lines) + "\n"
+
+    def flush(self, force=False):
+        """
+        Write the registry to METRICS_DIR/<service>.prom, at most once every
+        FLUSH_INTERVAL_SECONDS unless force is True.
+        """
+        now = time.monotonic()
+        if not force and now - self.last_flush < FLUSH_INTERVAL_SECONDS:
+            return
+        self.last_flush = now
+        self.gauge("vivi_process_cpu_seconds", "CPU time used by this service process.").set(round(time.process_time(), 3))
+        path = os.path.join(METRICS_DIR, f"{self.service}.prom")
+        try:
+            os.makedirs(METRICS_DIR, exist_ok=True)
+            # Write to a temporary file and rename, so readers never see a partial file.
+            tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp_path, "w") as f:
+                f.write(self.render())
+            os.replace(tmp_path, path)
+        except Exception as e:
+            log.error("Error writing metrics file", extra=kv(error=e))
+
+
+# The process-wide registry. Services name themselves via set_service().
+registry = Registry()
+
+
+def set_service(name):
+    """Set the service name used for the textfile name and the service label."""
+    registry.service = name
+
+
+def counter(name, help_text=""):
+    return registry.counter(name, help_text)
+
+
+def gauge(name, help_text=""):
+    return registry.gauge(name, help_text)
+
+
+def histogram(name, help_text="", buckets=DEFAULT_BUCKETS):
+    return registry.histogram(name, help_text, buckets)
+
+
+def flush(force=False):
+    registry.flush(force)
+
+
+if __name__ == "__main__":
+    # Print the latest metrics of every service.
+    if not os.path.isdir(METRICS_DIR):
+        print(f"No metrics found in {METRICS_DIR}.")
+        sys.exit(0)
+    for filename in sorted(os.listdir(METRICS_DIR)):
+        if filename.endswith(".prom"):
+            print(f"### {filename[:-len('.prom')]}")
+            with open(os.path.join(METRICS_DIR, filename)) as f:
+                print(f.read())
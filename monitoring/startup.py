@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+"""
+startup.py - Startup timing for the postbox services.
+
+Create a StartupTimer as early as possible in a service module, mark phases as
+they complete, then call report() once the service is up. The report is logged
+once and exported as the vivi_startup_seconds gauge, so slow cold starts after a
+power cut can be traced back to a specific import or hardware setup step.
+"""
+
+import os
+import time
+import logging
+import importlib
+import contextlib
+
+from monitoring import metrics
+from monitoring.logs import kv
+
+log = logging.getLogger("vivi.startup")
+
+STARTUP_SECONDS = metrics.gauge("vivi_startup_seconds", "Seconds spent in each startup phase.")
+
+
+def process_age():
+    """
+    Seconds since this process was exec'd, read from /proc (so it includes the
+    interpreter's own startup). Returns None where /proc is not available.
+    """
+    try:
+        with open("/proc/self/stat") as f:
+            # The command name may contain spaces, so split after its closing parenthesis.
+            fields = f.read().rsplit(")", 1)[1].split()
+        start_ticks = int(fields[19])
+        with open("/proc/uptime") as f:
+            uptime = float(f.read().split()[0])
+        return max(0.0, uptime - start_ticks / os.sysconf("SC_CLK_TCK"))
+    except Exception:
+        return None
+
+
+class StartupTimer:
+    """
+    Records how long each named startup phase of a service takes. Phases marked
+    after report() (e.g. hardware set up lazily on first use) are still exported.
+    """
+
+    def __init__(self, service):
+        self.service = service
+        self.started_at = time.perf_counter()
+        self.last_mark = self.started_at
+        self.phases = {}
+        # Time the interpreter spent before this timer was created.
+        interpreter = process_age()
+        if interpreter is not None:
+            self._add("interpreter", interpreter)
+
+    def _add(self, phase, seconds):
+        self.phases[phase] = self.phases.get(phase, 0.0) + seconds
+        STARTUP_SECONDS.set(round(self.phases[phase], 4), phase=phase)
+
+    def mark(self, phase):
+        """Record the time since the previous mark as the given phase."""
+        now = time.perf_counter()
+        self._add(phase, now - self.last_mark)
+        self.last_mark = now
+
+    @contextlib.contextmanager
+    def timed(self, phase):
+        """
+        Record the duration of a block as the given phase. Unlike mark(), this
+        works for steps deferred until first use. The time is also part of
+        whichever phase is marked next.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self._add(phase, time.perf_counter() - start)
+
+    def timed_import(self, name):
+        """Import a module, recording the import as its own phase."""
+        with self.timed(f"import {name}"):
+            return importlib.import_module(name)
+
+    def report(self):
+        """Log the startup phases so far, including the total time to get here."""
+        total = self.phases.get("interpreter", 0.0) + time.perf_counter() - self.started_at
+        STARTUP_SECONDS.set(round(total, 4), phase="total")
+        phases_ms = {f"{phase.replace(' ', '_')}_ms": round(seconds * 1000) for phase, seconds in self.phases.items()}
+        log.info("Startup timings", extra=kv(service=self.service, total_ms=round(total * 1000), **phases_ms))
+        return total
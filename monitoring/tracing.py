@@ -0,0 +1,182 @@
+#!/usr/bin/env python3
+"""
+tracing.py - Lightweight per-message latency tracing.
+
+Every service records timestamped events tagged with the message_id as the
+message moves through the postbox (poll detect, download, LED notification,
+hall trigger, playback, listen ack). Events are appended as JSON lines to a
+shared trace file on tmpfs, which is trimmed so it behaves as a bounded ring
+buffer.
+
+Running this module prints per-message timelines and percentile summaries:
+
+    python3 -m monitoring.tracing            # timelines of the last 10 messages + summary
+    python3 -m monitoring.tracing --last 50
+    python3 -m monitoring.tracing --summary  # summary only
+"""
+
+import os
+import sys
+import json
+import math
+import time
+import logging
+import threading
+import argparse
+
+from monitoring import RUNTIME_DIR
+from monitoring.logs import kv
+
+TRACE_FILE = os.environ.get("VIVI_TRACE_FILE", os.path.join(RUNTIME_DIR, "traces.jsonl"))
+log = logging.getLogger("vivi.tracing")
+
+# Once the file grows past this size, only the newest TRACE_KEEP_RECORDS lines are kept.
+TRACE_MAX_BYTES = 256 * 1024
+TRACE_KEEP_RECORDS = 1000
+
+# The events of one message, in pipeline order.
+EVENTS = (
+    "poll_detect",
+    "download_start",
+    "download_end",
+    "message_pending",
+    "first_led_frame",
+    "hall_trigger",
+    "player_start",
+    "player_end",
+    "ack_sent",
+)
+
+# Named stages (start event, end event) reported by the summary.
+STAGES = (
+    ("download", "download_start", "download_end"),
+    ("detect_to_pending", "poll_detect", "message_pending"),
+    ("pending_to_led", "message_pending", "first_led_frame"),
+    ("pending_to_trigger", "message_pending", "hall_trigger"),
+    ("trigger_to_audio", "hall_trigger", "player_start"),
+    ("playback", "player_start", "player_end"),
+    ("playback_to_ack", "player_end", "ack_sent"),
+    ("end_to_end", "poll_detect", "ack_sent"),
+)
+
+# Last message_id recorded per event by record_once().
+_recorded_once = {}
+
+
+def record(message_id, event):
+    """
+    Append a trace event for the given message.
+
+    Args:
+        message_id: The server-side message id. Events without an id are dropped.
+        event (str): One of EVENTS.
+    """
+    if message_id is None or message_id == "":
+        return
+    line = json.dumps({"id": message_id, "event": event, "t": round(time.time(), 4)}, separators=(",", ":")) + "\n"
+    try:
+        os.makedirs(os.path.dirname(TRACE_FILE), exist_ok=True)
+        # A single small O_APPEND write keeps lines from different services intact.
+        with open(TRACE_FILE, "a") as f:
+            f.write(line)
+            size = f.tell()
+        if size > TRACE_MAX_BYTES:
+            _trim()
+    except Exception as e:
+        log.error("Error writing trace file", extra=kv(error=e))
+
+
+def record_once(message_id, event):
+    """Record an event only the first time it is seen for this message in this process."""
+    if _recorded_once.get(event) == message_id:
+        return
+    _recorded_once[event] = message_id
+    record(message_id, event)
+
+
+def _trim():
+    with open(TRACE_FILE, "r") as f:
+        lines = f.readlines()
+    tmp_path = f"{TRACE_FILE}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, "w") as f:
+        f.writelines(lines[-TRACE_KEEP_RECORDS:])
+    os.replace(tmp_path, TRACE_FILE)
+
+
+def load_traces(path=TRACE_FILE):
+    """
+    Load the trace file and group it by message.
+
+    Returns:
+        list: (message_id, {event: first timestamp}) tuples, oldest message first.
+    """
+    traces = {}
+    if not os.path.exists(path):
+        return []
+    with open(path, "r") as f:
+        for line in f:
+            try:
+                item = json.loads(line)
+            except ValueError:
+                continue  # A line cut short by trimming.
+            events = traces.setdefault(item["id"], {})
+            events.setdefault(item["event"], item["t"])
+    return sorted(traces.items(), key=lambda entry: min(entry[1].values()))
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile of a non-empty list."""
+    ordered = sorted(values)
+    rank = max(1, math.ceil(pct / 100 * len(ordered)))
+    return ordered[rank - 1]
+
+
+def stage_durations(traces):
+    """Return {stage name: [durations in seconds]} over all traced messages."""
+    durations = {name: [] for name, _, _ in STAGES}
+    for _, events in traces:
+        for name, start, end in STAGES:
+            if start in events and end in events and events[end] >= events[start]:
+                durations[name].append(events[end] - events[start])
+    return durations
+
+
+def print_timeline(message_id, events):
+    start = min(events.values())
+    print(f"message {message_id} ({time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(start))})")
+    for event in sorted(events, key=events.get):
+        print(f"  {events[event] - start:>10.3f}s  {event}")
+
+
+def print_summary(traces):
+    print(f"{'stage':<20}{'n':>6}{'p50':>10}{'p90':>10}{'p99':>10}{'max':>10}")
+    for name, values in stage_durations(traces).items():
+        if not values:
+            continue
+        print(
+            f"{name:<20}{len(values):>6}"
+            f"{percentile(values, 50):>10.3f}{percentile(values, 90):>10.3f}"
+            f"{percentile(values, 99):>10.3f}{max(values):>10.3f}"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Print per-message latency traces.")
+    parser.add_argument("--last", type=int, default=10, help="number of message timelines to print")
+    parser.add_argument("--summary", action="store_true", help="only print the percentile summary")
+    parser.add_argument("--file", default=TRACE_FILE, help="trace file to read")
+    args = parser.parse_args()
+
+    traces = load_traces(args.file)
+    if not traces:
+        print(f"No traces found in {args.file}.")
+        sys.exit(0)
+    if not args.summary:
+        for message_id, events in traces[-args.last:]:
+            print_timeline(message_id, events)
+        print()
+    print_summary(traces)
+
+
+if __name__ == "__main__":
+    main()
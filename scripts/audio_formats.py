@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+"""
+Audio Formats
+
+The message formats the postbox can play, shared by the HTTP checker (which
+advertises them to the API and names downloads by format) and the audio player
+(which picks the decoder for a file).
+
+- Formats are listed in order of preference: Opus at voice bitrates is several
+  times smaller than MP3 for the same message, which matters on a weak Wi-Fi link.
+- A format is only advertised when its player tools are installed; MP3 is always
+  advertised, as it is what the API sends by default.
+- Files of an unknown format are treated as MP3, like before negotiation existed.
+"""
+
+import os
+import shutil
+
+ALSA_DEVICE = "plughw:2,0"
+DEFAULT_FORMAT = "mp3"
+# Placeholder for the audio file in the player commands below.
+PATH = "{path}"
+
+# Each player is a pipeline: every command's stdout feeds the next command's stdin.
+FORMATS = {
+    "opus": {
+        # Not bare audio/ogg or .ogg: those may be Vorbis, which opusdec cannot play.
+        "content_types": ("audio/ogg; codecs=opus", "audio/opus"),
+        "extensions": (".opus",),
+        "quality": 1.0,
+        # opusdec writes WAV to stdout (+6 dB, like mpg321 -g 200) for aplay.
+        "player": (
+            ["opusdec", "--quiet", "--force-wav", "--gain", "6", PATH, "-"],
+            ["aplay", "-q", "-D", ALSA_DEVICE],
+        ),
+    },
+    "mp3": {
+        "content_types": ("audio/mpeg", "audio/mp3"),
+        "extensions": (".mp3",),
+        "quality": 0.8,
+        "player": (["mpg321", "-o", "alsa", "-a", ALSA_DEVICE, "-g", "200", PATH],),
+    },
+    "wav": {
+        "content_types": ("audio/wav", "audio/x-wav", "audio/wave"),
+        "extensions": (".wav",),
+        "quality": 0.5,
+        "player": (["aplay", "-q", "-D", ALSA_DEVICE, PATH],),
+    },
+}
+
+
+def installed(fmt):
+    """Return whether every tool in the format's player pipeline is on the PATH."""
+    return all(shutil.which(command[0]) for command in FORMATS[fmt]["player"])
+
+
+def accept_header():
+    """Return the Accept header value advertising the formats this device can play."""
+    values = []
+    for fmt, spec in FORMATS.items():
+        if fmt != DEFAULT_FORMAT and not installed(fmt):
+            continue
+        content_type = spec["content_types"][0]
+        values.append(content_type if spec["quality"] >= 1 else f"{content_type};q={spec['quality']}")
+    return ", ".join(values)
+
+
+def _split_content_type(content_type):
+    """Split a Content-Type into its normalized media type and parameters."""
+    return [part.strip().lower().replace('"', "").replace(" ", "") for part in content_type.split(";")]
+
+
+def format_for(content_type=None, url=None):
+    """
+    Work out the format of a download, preferring the response's Content-Type
+    over the extension in its URL.
+
+    Args:
+        content_type (str): The Content-Type header of the response, if any.
+        url (str): The download URL.
+
+    Returns:
+        str: A key of FORMATS.
+    """
+    if content_type:
+        media_type, *params = _split_content_type(content_type)
+        for fmt, spec in FORMATS.items():
+            for value in spec["content_types"]:
+                # Parameters listed for a format (e.g. codecs=opus) must be present too.
+                value_type, *value_params = _split_content_type(value)
+                if value_type == media_type and all(param in params for param in value_params):
+                    return fmt
+    if url:
+        return format_for_path(url.split("?")[0])
+    return DEFAULT_FORMAT
+
+
+def format_for_path(path):
+    """Return the format of a file from its extension, DEFAULT_FORMAT if it is unknown."""
+    ext = os.path.splitext(path)[1].lower()
+    for fmt, spec in FORMATS.items():
+        if ext in spec["extensions"]:
+            return fmt
+    return DEFAULT_FORMAT
+
+
+def extension(fmt):
+    """Return the file extension (including the dot) archived files of a format get."""
+    return FORMATS[fmt]["extensions"][0]
+
+
+def player_commands(path):
+    """Return the player pipeline for an audio file, as a list of argument lists."""
+    return [[path if arg == PATH else arg for arg in command] for command in FORMATS[format_for_path(path)]["player"]]
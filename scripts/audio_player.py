@@ -5,82 +5,197 @@ Audio Player Script
 This script continuously monitors the shared state and the Hall Effect sensor.
 When a pending message exists and the sensor is triggered, it:
 1) Sets the 'playing' state to True.
-2) Plays the MP3 from the filepath in the state using a command-line MP3 player.
+2) Plays the audio file from the filepath in the state, with the command-line
+   player for its format (mpg321 for MP3, opusdec and aplay for Opus, aplay for WAV).
 3) Once playback finishes, sets 'playing' and 'message_pending' to False.
+   The file stays in the message archive for replays.
+
+When no message is pending, triggering the sensor twice within
+DOUBLE_TRIGGER_SECONDS replays the last REPLAY_COUNT messages from the archive.
 """
 
 import time
+from monitoring.startup import StartupTimer
+
+startup = StartupTimer("audio_player")
+
 import subprocess
-from gpiozero import Button
+from monitoring import metrics, tracing
+from monitoring.logs import get_logger, kv
+from scripts import audio_formats, message_archive
 from state_management.state_management import read_state, write_state
-import sys
+
+log = get_logger("audio_player")
+startup.mark("imports")
 
 # Configure the GPIO pin connected to the Hall Effect sensor.
 HALL_PIN = 17
-hall_sensor = Button(HALL_PIN, pull_up=True)
+# Created on first use by get_hall_sensor(), so importing this module stays cheap.
+hall_sensor = None
+# Replay gesture: two sensor triggers within this many seconds while no message is pending.
+DOUBLE_TRIGGER_SECONDS = 1.5
+# How many of the most recent messages a replay plays.
+REPLAY_COUNT = 3
+
+LOOP_TIME = metrics.histogram("vivi_loop_iteration_seconds", "Duration of one main loop iteration, excluding the idle sleep.")
+TRIGGER_TO_AUDIO = metrics.histogram("vivi_trigger_to_audio_start_seconds", "Time from the hall sensor trigger to the player being started.")
+PLAYBACK_TIME = metrics.histogram("vivi_playback_seconds", "Duration of message playback.", buckets=(1, 5, 10, 30, 60, 120, 300))
+PLAYER_ERRORS = metrics.counter("vivi_player_errors_total", "Player pipelines that failed to start or exited with an error, by format.")
+
+# Total time spent waiting for the player or pausing, so loop timings can leave it out.
+_idle = {"seconds": 0.0}
 
-def play_mp3(filepath):
-    print(f"Playing MP3: {filepath}")
-    process = subprocess.Popen(["mpg321", "-o", "alsa", "-a", "plughw:2,0", "-g", "200", filepath])
+
+def get_hall_sensor():
+    """Import gpiozero and set up the Hall Effect sensor on first use."""
+    global hall_sensor
+    if hall_sensor is None:
+        with startup.timed("sensor_init"):
+            gpiozero = startup.timed_import("gpiozero")
+            hall_sensor = gpiozero.Button(HALL_PIN, pull_up=True)
+    return hall_sensor
+
+
+def start_player(filepath):
+    """
+    Start the player pipeline for the file's format and return its processes,
+    the one producing the sound last. Raises OSError (e.g. a missing decoder)
+    after stopping any command already started.
+    """
+    commands = audio_formats.player_commands(filepath)
+    processes = []
     try:
-        # Wait for mpg321 to finish normally
-        process.wait()
+        for args in commands:
+            last = len(processes) == len(commands) - 1
+            stdin = processes[-1].stdout if processes else None
+            processes.append(subprocess.Popen(args, stdin=stdin, stdout=None if last else subprocess.PIPE))
+            if stdin is not None:
+                stdin.close()  # Only the next command reads the pipe now.
+    except OSError:
+        for process in processes:
+            process.terminate()
+            process.wait()
+        raise
+    return processes
+
+
+def play_mp3(filepath, triggered_at=None, message_id=None):
+    """
+    Play an audio file and wait for it to finish.
+
+    Returns:
+        bool: False if the player could not be started or any of its commands failed.
+    """
+    fmt = audio_formats.format_for_path(filepath)
+    log.info("Playing message", extra=kv(path=filepath, format=fmt, message_id=message_id))
+    try:
+        processes = start_player(filepath)
+    except OSError as e:
+        PLAYER_ERRORS.inc(format=fmt)
+        log.error("Failed to start the player", extra=kv(path=filepath, format=fmt, message_id=message_id, error=e))
+        return False
+    started_at = time.perf_counter()
+    tracing.record(message_id, "player_start")
+    if triggered_at is not None:
+        TRIGGER_TO_AUDIO.observe(started_at - triggered_at)
+    try:
+        # Wait for the player to finish normally
+        for process in reversed(processes):
+            process.wait()
+        _idle["seconds"] += time.perf_counter() - started_at
+        PLAYBACK_TIME.observe(time.perf_counter() - started_at)
+        tracing.record(message_id, "player_end")
+        failed = [(process.args[0], process.returncode) for process in processes if process.returncode != 0]
+        if failed:
+            PLAYER_ERRORS.inc(format=fmt)
+            log.error("Player failed", extra=kv(path=filepath, format=fmt, message_id=message_id, exit_codes=failed))
+            return False
+        return True
     except KeyboardInterrupt:
-        print("KeyboardInterrupt caught; terminating mpg321.")
-        process.terminate()  # Send SIGTERM
-        process.wait()       # Wait for it to exit
+        log.info("KeyboardInterrupt caught; terminating the player.")
+        for process in processes:
+            process.terminate()  # Send SIGTERM
+            process.wait()       # Wait for it to exit
         raise  # Re-raise to let the top-level code handle clean shutdown
 
-def cleanup_mp3():
+
+def replay_recent():
     """
-    Loads the current state, deletes the MP3 file specified in the state, 
-    and resets the mp3_path and message_pending flag.
+    Plays the last REPLAY_COUNT messages straight from the local archive, oldest first.
     """
-    current_state = read_state()
-    mp3_path = current_state.get("mp3_path", "")
-    
-    if mp3_path and os.path.exists(mp3_path):
-        try:
-            os.remove(mp3_path)
-            print(f"Deleted MP3 file at {mp3_path}")
-        except Exception as e:
-            print(f"Error deleting MP3 file: {e}")
-    else:
-        print("No MP3 file found for cleanup.")
+    messages = message_archive.recent(REPLAY_COUNT)
+    if not messages:
+        log.info("Replay requested, but the archive is empty.")
+        return
+    log.info("Replaying recent messages", extra=kv(count=len(messages)))
+    for message_id, path in messages:
+        if play_mp3(path):
+            message_archive.touch(message_id)
 
 
 def main():
-    print("Audio player started. Waiting for pending message and sensor trigger.")
+    log.info("Audio player started. Waiting for pending message and sensor trigger.")
+    metrics.set_service("audio_player")
+    startup.report()
+    # Only this service sets 'playing'; a leftover flag means it died mid-playback.
+    state = read_state()
+    if state.get("playing"):
+        state["playing"] = False
+        write_state(state)
+        log.warning("Cleared a stale playing flag", extra=kv(message_id=state.get("message_id")))
+    was_pressed = False
+    last_trigger_at = None
     while True:
+        loop_start = time.perf_counter()
+        idle_at_start = _idle["seconds"]
         state = read_state()
-        sys.stdout.flush()
+        pressed = get_hall_sensor().is_pressed
         # Check if there is a pending message and we are not already playing.
         if state and state.get("message_pending") and not state.get("playing"):
             # Wait for the sensor to be triggered.
-            if hall_sensor.is_pressed:
-                print("Hall sensor triggered.\n\n")
+            if pressed:
+                triggered_at = time.perf_counter()
+                tracing.record(state.get("message_id"), "hall_trigger")
+                log.info("Hall sensor triggered", extra=kv(message_id=state.get("message_id")))
                 mp3_path = state.get("mp3_path")
                 if not mp3_path:
-                    print("No MP3 filepath found in state; skipping playback.")
+                    log.warning("No MP3 filepath found in state; skipping playback.")
                 else:
                     # Update state to indicate playback is starting.
                     new_state = state.copy()
                     new_state["playing"] = True
                     write_state(new_state)
 
-                    # Play the MP3.
-                    play_mp3(mp3_path)
-
-                    # After playback, update the state to clear pending and playing flags.
-                    new_state["playing"] = False
-                    new_state["message_pending"] = False
-                    new_state["message_listened"] = True
-                    write_state(new_state)
-                    print("Playback finished; state updated.")
-                    # Delete mp3 file
-                    cleanup_mp3()
-                    # Small pause to allow state change to propagate.
+                    played = False
+                    try:
+                        # Play the message.
+                        played = play_mp3(mp3_path, triggered_at, state.get("message_id"))
+                    finally:
+                        # Always clear the playing flag; only a finished playback clears pending.
+                        new_state["playing"] = False
+                        if played:
+                            new_state["message_pending"] = False
+                            new_state["message_listened"] = True
+                        write_state(new_state)
+                    if played:
+                        log.info("Playback finished; state updated.")
+                        # Keep the file in the archive, as the most recently used message
+                        message_archive.touch(state.get("message_id"))
+                    # Small pause to allow state change to propagate (and not to retry a failed player at once).
+                    pause_start = time.perf_counter()
                     time.sleep(1)
+                    _idle["seconds"] += time.perf_counter() - pause_start
+        elif pressed and not was_pressed and not state.get("playing"):
+            # A fresh trigger with nothing pending: two in quick succession request a replay.
+            now = time.monotonic()
+            if last_trigger_at is not None and now - last_trigger_at <= DOUBLE_TRIGGER_SECONDS:
+                last_trigger_at = None
+                replay_recent()
+            else:
+                last_trigger_at = now
+        was_pressed = pressed
+        LOOP_TIME.observe(time.perf_counter() - loop_start - (_idle["seconds"] - idle_at_start))
+        metrics.flush()
         # Poll every 0.1 seconds.
         time.sleep(0.1)
 
@@ -89,4 +204,4 @@ if __name__ == "__main__":
     try:
         main()
     except KeyboardInterrupt:
-        print("Audio player interrupted. Exiting.")
+        log.info("Audio player interrupted. Exiting.")
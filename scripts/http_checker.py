@@ -2,57 +2,109 @@
 """
 HTTP Checker Script
 
-- Periodically polls an HTTP endpoint.
-- Downloads an MP3 file when a specific response is detected.
+- Listens for 'new_post' and 'nightlight' events on the API's push channel.
+- While the push channel is unavailable, periodically polls the HTTP endpoints instead.
+- Downloads the message audio when a specific response is detected, in the most
+  compact format both the API and this device support (see audio_formats).
 """
 
-import os
 import time
-import requests
+from monitoring.startup import StartupTimer
+
+startup = StartupTimer("http_checker")
+
+import hashlib
+from monitoring import metrics, tracing
+from monitoring.logs import get_logger, kv
+from scripts import audio_formats, message_archive
+from scripts.push_channel import PushSubscriber
 from state_management.state_management import read_state, write_state
-import sys
+
+log = get_logger("http_checker")
+startup.mark("imports")
 
 # Configuration
 POLL_INTERVAL_SECONDS = 5  # how often to poll the endpoint
 PENDING_SLEEP_SECONDS = 1  # how long to wait for pending message to be cleared.
 GET_POST_ENDPOINT = "https://api.thinkkappi.com/vivi/get_post"
-DOWNLOAD_DIR = "/home/pi/mp3_downloads"  # change as needed
 NIGHTLIGHT_ENDPOINT = "https://api.thinkkappi.com/vivi/nightlight"
+LISTEN_POST_ENDPOINT = "https://api.thinkkappi.com/vivi/listen_post/{message_id}"
+PUSH_ENDPOINT = "https://api.thinkkappi.com/vivi/events"
+PUSH_CHECK_SECONDS = 0.5  # how often to handle queued push events while connected
+PUSH_RESYNC_SECONDS = 300  # how often to poll anyway while connected, in case an event was lost
 
+LOOP_TIME = metrics.histogram("vivi_loop_iteration_seconds", "Duration of one main loop iteration, excluding the idle sleep.")
+HTTP_LATENCY = metrics.histogram("vivi_http_request_seconds", "Latency of API requests.")
+HTTP_REQUESTS = metrics.counter("vivi_http_requests_total", "API requests made.")
+HTTP_ERRORS = metrics.counter("vivi_http_errors_total", "API requests that failed.")
+DOWNLOAD_BYTES = metrics.counter("vivi_download_bytes_total", "Bytes of message audio downloaded.")
+DOWNLOAD_THROUGHPUT = metrics.gauge("vivi_download_bytes_per_second", "Throughput of the most recent download.")
+
+# requests is imported and the HTTP session created on first use by get_session().
+# The session also keeps the connection to the API alive between polls.
+session = None
+
+
+def get_session():
+    """Return the shared HTTP session, importing requests on first use."""
+    global session
+    if session is None:
+        with startup.timed("http_init"):
+            requests = startup.timed_import("requests")
+            session = requests.Session()
+    return session
 
-def download_mp3(mp3_url):
-    """Downloads the MP3 file from the given URL and returns the local file path."""
-    try:
-        # Create download directory if it doesn't exist
-        if not os.path.exists(DOWNLOAD_DIR):
-            os.makedirs(DOWNLOAD_DIR)
 
-        # Use the last part of the URL as the filename
-        filename = os.path.basename(mp3_url)
-        local_path = os.path.join(DOWNLOAD_DIR, filename)
+def download_mp3(mp3_url, message_id):
+    """
+    Downloads the message audio from the given URL into the message archive and
+    returns the archived file path.
 
-        # Stream the download and write to file
-        response = requests.get(mp3_url, stream=True)
+    The request advertises the formats this device can play; the file is stored
+    in whatever format the server answers with.
+    """
+    try:
+        download_path = message_archive.new_download_path()
+
+        # Stream the download to a temporary file, hashing it on the way
+        start = time.perf_counter()
+        size = 0
+        sha = hashlib.sha256()
+        HTTP_REQUESTS.inc(endpoint="download")
+        response = get_session().get(mp3_url, stream=True, headers={"Accept": audio_formats.accept_header()})
         response.raise_for_status()  # Raise an exception for HTTP errors
-        with open(local_path, "wb") as f:
+        with open(download_path, "wb") as f:
             for chunk in response.iter_content(chunk_size=8192):
                 if chunk:
                     f.write(chunk)
-        print(f"Downloaded MP3 to {local_path}")
+                    sha.update(chunk)
+                    size += len(chunk)
+        # Name the file by the format the server sent, so the player picks the right decoder
+        fmt = audio_formats.format_for(response.headers.get("Content-Type"), mp3_url)
+        local_path = message_archive.store(message_id, download_path, sha.hexdigest(), audio_formats.extension(fmt))
+        elapsed = time.perf_counter() - start
+        HTTP_LATENCY.observe(elapsed, endpoint="download")
+        DOWNLOAD_BYTES.inc(size, format=fmt)
+        DOWNLOAD_THROUGHPUT.set(size / elapsed if elapsed > 0 else 0)
+        log.info("Downloaded message audio", extra=kv(path=local_path, format=fmt, bytes=size, seconds=round(elapsed, 3)))
         return local_path
     except Exception as e:
-        print(f"Failed to download MP3 from {mp3_url}: {e}")
+        HTTP_ERRORS.inc(endpoint="download")
+        log.error("Failed to download message audio", extra=kv(url=mp3_url, message_id=message_id, error=e))
         return None
 
 
 def poll_endpoint():
     """Polls the HTTP endpoint and processes the response."""
+    HTTP_REQUESTS.inc(endpoint="get_post")
     try:
-        response = requests.get(GET_POST_ENDPOINT)
+        with HTTP_LATENCY.time(endpoint="get_post"):
+            response = get_session().get(GET_POST_ENDPOINT)
         response.raise_for_status()
         data = response.json()
     except Exception as e:
-        print(f"Error fetching data from {GET_POST_ENDPOINT}: {e}")
+        HTTP_ERRORS.inc(endpoint="get_post")
+        log.warning("Error fetching post", extra=kv(url=GET_POST_ENDPOINT, error=e))
         return
 
     msg_type = data.get("type")
@@ -60,18 +112,22 @@ def poll_endpoint():
     msg_id = data.get("id")
 
     if mp3_url:
+        tracing.record(msg_id, "poll_detect")
         # Download the MP3
-        local_mp3_path = download_mp3(mp3_url)
+        tracing.record(msg_id, "download_start")
+        local_mp3_path = download_mp3(mp3_url, msg_id)
         if local_mp3_path:
+            tracing.record(msg_id, "download_end")
             # Update state to set message pending and store mp3 path
             current_state = read_state()
             current_state["message_pending"] = True
             current_state["mp3_path"] = local_mp3_path
             current_state["message_id"] = msg_id
             write_state(current_state)
-            print("State updated: message pending set to True and mp3 path saved.")
+            tracing.record(msg_id, "message_pending")
+            log.info("Message pending", extra=kv(message_id=msg_id, mp3_path=local_mp3_path))
     else:
-        print(f"Received non-audio message or missing mp3_url. Type: {msg_type}, id: {msg_id}")
+        log.info("Received non-audio message or missing mp3_url", extra=kv(type=msg_type, message_id=msg_id))
 
 
 def mark_message_listened():
@@ -83,72 +139,132 @@ def mark_message_listened():
     write_state(current_state)
 
     if not message_id:
-        print("No message ID found to mark as listened.")
+        log.warning("No message ID found to mark as listened.")
         return
 
-    print(f"Marking message {message_id} as listened in the online DB.")
-    url = f"https://api.thinkkappi.com/vivi/listen_post/{message_id}"
+    log.info("Marking message as listened in the online DB", extra=kv(message_id=message_id))
+    url = LISTEN_POST_ENDPOINT.format(message_id=message_id)
 
+    HTTP_REQUESTS.inc(endpoint="listen_post")
     try:
-        response = requests.delete(url)
+        with HTTP_LATENCY.time(endpoint="listen_post"):
+            response = get_session().delete(url)
         if response.status_code == 200:
-            print(f"Success: Message {message_id} marked as listened. Telegram notification sent.")
+            tracing.record(message_id, "ack_sent")
+            log.info("Message marked as listened, Telegram notification sent", extra=kv(message_id=message_id))
         else:
-            print(f"Failed to mark message {message_id}: Status {response.status_code}")
-            print(f"Response: {response.text}")
+            HTTP_ERRORS.inc(endpoint="listen_post")
+            log.error(
+                "Failed to mark message as listened",
+                extra=kv(message_id=message_id, status=response.status_code, response=response.text),
+            )
 
     except Exception as e:
-        print(f"Network error calling listen endpoint: {e}")
+        HTTP_ERRORS.inc(endpoint="listen_post")
+        log.warning("Network error calling listen endpoint", extra=kv(message_id=message_id, error=e))
+
+
+def set_nightlight(api_status):
+    """Stores the nightlight status in the local state file, if it changed."""
+    current_state = read_state()
+    if current_state.get("nightlight_on") != api_status:
+        current_state["nightlight_on"] = api_status
+        write_state(current_state)
 
 
 def check_for_nightlight():
     """Polls the nightlight endpoint and updates the local state file."""
+    HTTP_REQUESTS.inc(endpoint="nightlight")
     try:
-        response = requests.get(NIGHTLIGHT_ENDPOINT)
+        with HTTP_LATENCY.time(endpoint="nightlight"):
+            response = get_session().get(NIGHTLIGHT_ENDPOINT)
         response.raise_for_status()
         data = response.json()
 
         # Get the boolean from the API response: {"nightlight": true/false}
         api_status = data.get("nightlight", False)
+        set_nightlight(api_status)
+        log.debug("Nightlight checked", extra=kv(nightlight_on=api_status))
 
-        # 1. Read current state
-        current_state = read_state()
+    except Exception as e:
+        HTTP_ERRORS.inc(endpoint="nightlight")
+        log.warning("Error checking nightlight API", extra=kv(url=NIGHTLIGHT_ENDPOINT, error=e))
 
-        # 2. Update the specific nightlight key
-        current_state["nightlight_on"] = api_status
 
-        # 3. Write back to the state file
-        write_state(current_state)
+def check_once():
+    """
+    Runs one iteration of the polling loop and returns how long to sleep afterwards.
+    """
+    check_for_nightlight()
+    current_state = read_state()
+    nightlight_on = current_state.get("nightlight_on", False)
+    if nightlight_on:
+        log.info("Nightlight is ON - skipping message polling.")
+        return POLL_INTERVAL_SECONDS
+    pending_message = current_state.get("message_pending", False)
+    if pending_message:
+        return PENDING_SLEEP_SECONDS
+    message_listened = current_state.get("message_listened", False)
+    if message_listened:
+        mark_message_listened()
+    poll_endpoint()
+    return POLL_INTERVAL_SECONDS
 
-        if api_status:
-            print("Nightlight on: True")
-        else:
-            print("Nightlight on: False")
 
-    except Exception as e:
-        print(f"Error checking nightlight API: {e}")
+def push_once(subscriber, poll_requested):
+    """
+    Runs one iteration of the push loop: applies queued events and only polls
+    the API when a new post was announced (or a listen ack may free the next one).
+
+    Returns:
+        bool: Whether a poll is still owed (e.g. a post arrived while another was pending).
+    """
+    while True:
+        event = subscriber.next_event()
+        if event is None:
+            break
+        event_type, payload = event
+        if event_type == "nightlight":
+            set_nightlight(payload.get("nightlight", False))
+        elif event_type == "new_post":
+            poll_requested = True
+
+    current_state = read_state()
+    if current_state.get("nightlight_on", False) or current_state.get("message_pending", False):
+        return poll_requested
+    if current_state.get("message_listened", False):
+        mark_message_listened()
+        # The server may have queued further posts behind the one just acknowledged.
+        poll_requested = True
+    if poll_requested:
+        poll_endpoint()
+    return False
 
 
 def main():
-    print("Starting HTTP Checker...")
+    log.info("Starting HTTP Checker...")
+    metrics.set_service("http_checker")
+    startup.report()
+    subscriber = PushSubscriber(PUSH_ENDPOINT)
+    subscriber.start()
+    synced_connection = 0
+    last_sync = 0.0
+    poll_requested = False
     while True:
-        sys.stdout.flush()
-        check_for_nightlight()
-        current_state = read_state()
-        nightlight_on = current_state.get("nightlight_on", False)
-        if nightlight_on:
-            print("Nightlight is ON - skipping message polling.")
-            time.sleep(POLL_INTERVAL_SECONDS)
-            continue
-        pending_message = current_state.get("message_pending", False)
-        if pending_message:
-            time.sleep(PENDING_SLEEP_SECONDS)
-            continue
-        message_listened = current_state.get("message_listened", False)
-        if message_listened:
-            mark_message_listened()
-        poll_endpoint()
-        time.sleep(POLL_INTERVAL_SECONDS)
+        with LOOP_TIME.time():
+            if subscriber.connected.is_set():
+                # Resync after every (re)connect and periodically, in case events were missed.
+                if synced_connection != subscriber.connections or time.monotonic() - last_sync >= PUSH_RESYNC_SECONDS:
+                    synced_connection = subscriber.connections
+                    last_sync = time.monotonic()
+                    check_for_nightlight()
+                    poll_requested = True
+                poll_requested = push_once(subscriber, poll_requested)
+                sleep_seconds = PUSH_CHECK_SECONDS
+            else:
+                sleep_seconds = check_once()
+        metrics.flush()
+        time.sleep(sleep_seconds)
 
 
 if __name__ == "__main__":
@@ -2,6 +2,7 @@
 """
 LED Display Script with Full-Cycle Pulsing and Smooth Interrupt Transitions
 
+- Shows a dim "booting" frame as soon as the LED strip is initialized.
 - Reads the state from the shared state_management module.
 - If no pending message: turns LEDs off.
 - If a pending message exists: displays a gentle pulsing, multicolored light (256 steps).
@@ -10,45 +11,117 @@ LED Display Script with Full-Cycle Pulsing and Smooth Interrupt Transitions
 """
 
 import time
+from monitoring.startup import StartupTimer
+
+startup = StartupTimer("led_display")
+
 import math
 import random
+from monitoring import metrics, tracing
+from monitoring.logs import get_logger, kv
 from state_management.state_management import read_state, write_state
-import sys
 
-sys.path.append("/home/pi/git/vivi_postbox/venv/lib/python3.11/site-packages")
+log = get_logger("led_display")
+startup.mark("imports")
+
+
+class DummyPixelStrip:
+    """Stand-in used when rpi_ws281x is not available (e.g. on macOS)."""
 
-# Try to import the rpi_ws281x library. If not available (e.g. on macOS), define dummy functions.
-try:
-    from rpi_ws281x import PixelStrip, Color
-except Exception as e:
-    print(f"FAILED to import rpi_ws281x: {type(e).__name__}: {e}")
-    print("Using dummy LED functions...")
+    def __init__(self, num, pin, freq_hz=800000, dma=10, invert=False, brightness=255, channel=0):
+        self.num = num
 
-    class PixelStrip:
-        def __init__(self, num, pin, freq_hz=800000, dma=10, invert=False, brightness=255, channel=0):
-            self.num = num
+    def begin(self):
+        pass
 
-        def begin(self):
-            pass
+    def show(self):
+        pass
 
-        def show(self):
-            pass
+    def setPixelColor(self, i, color):
+        pass
 
-        def setPixelColor(self, i, color):
-            pass
 
-    def Color(r, g, b):
-        return (r, g, b)
+def Color(r, g, b):
+    return (r, g, b)
 
 
 # LED configuration
 LED_COUNT = 12  # Number of LED pixels.
 LED_PIN = 12  # GPIO pin connected to the pixels (must support PWM!)
 LED_BRIGHTNESS = 200  # Brightness (0 to 255)
+BOOTING_COLOR = (0, 0, 40)  # Dim blue, shown as soon as the strip is up.
+
+# The LED strip is created by init_strip(), so importing this module stays cheap.
+strip = None
+
+
+def init_strip():
+    """
+    Import rpi_ws281x and initialize the LED strip. If the library is not
+    available (e.g. on macOS), fall back to dummy LED functions.
+    """
+    global strip, Color
+    try:
+        rpi_ws281x = startup.timed_import("rpi_ws281x")
+        PixelStrip = rpi_ws281x.PixelStrip
+        Color = rpi_ws281x.Color
+    except Exception as e:
+        log.error("FAILED to import rpi_ws281x", extra=kv(error=f"{type(e).__name__}: {e}"))
+        log.warning("Using dummy LED functions...")
+        PixelStrip = DummyPixelStrip
+    strip = PixelStrip(LED_COUNT, LED_PIN, brightness=LED_BRIGHTNESS)
+    strip.begin()
+    startup.mark("strip_init")
+
+
+def show_booting():
+    """Show a static, dim "booting" frame until the first state is read."""
+    for i in range(LED_COUNT):
+        strip.setPixelColor(i, Color(*BOOTING_COLOR))
+    strip.show()
+    startup.mark("first_frame")
+
+
+LOOP_TIME = metrics.histogram("vivi_loop_iteration_seconds", "Duration of one main loop iteration, excluding the idle sleep.")
+FRAMES = metrics.counter("vivi_led_frames_total", "Animation frames pushed to the LED ring.")
+FRAME_OVERRUNS = metrics.counter("vivi_led_frame_overruns_total", "Animation frames that took longer to compute than their frame delay.")
+LED_FPS = metrics.gauge("vivi_led_fps", "Achieved animation frame rate over the last second.")
 
-# Initialize the LED strip
-strip = PixelStrip(LED_COUNT, LED_PIN, brightness=LED_BRIGHTNESS)
-strip.begin()
+# Gaps longer than this between frames mean a new animation started, not an overrun.
+FRAME_GAP_SECONDS = 1.0
+# idle_seconds: total time spent waiting for frame delays, so loop timings can leave it out.
+_frame_timing = {"frame_start": None, "window_start": None, "window_frames": 0, "idle_seconds": 0.0}
+
+
+def show_frame(delay):
+    """
+    Show the current animation frame, then wait for the frame delay.
+    Records the achieved frame rate and counts frames whose computation
+    (time since the previous frame's delay ended) exceeded the delay.
+    Also writes out the metrics when due, as an animation can run for minutes.
+
+    Args:
+        delay (float): Delay (in seconds) until the next frame.
+    """
+    strip.show()
+    now = time.perf_counter()
+    FRAMES.inc()
+    frame_start = _frame_timing["frame_start"]
+    if frame_start is not None and delay < now - frame_start < FRAME_GAP_SECONDS:
+        FRAME_OVERRUNS.inc()
+    if _frame_timing["window_start"] is None:
+        _frame_timing["window_start"] = now
+    _frame_timing["window_frames"] += 1
+    window = now - _frame_timing["window_start"]
+    if window >= 1.0:
+        LED_FPS.set(round(_frame_timing["window_frames"] / window, 1))
+        _frame_timing["window_start"] = now
+        _frame_timing["window_frames"] = 0
+    metrics.flush()
+    sleep_start = time.perf_counter()
+    time.sleep(delay)
+    _frame_timing["frame_start"] = time.perf_counter()
+    _frame_timing["idle_seconds"] += _frame_timing["frame_start"] - sleep_start
 
 
 def led_off():
@@ -74,17 +147,19 @@ def fade_out(current_colors, steps=10, delay=0.02):
             new_g = int(g * factor)
             new_b = int(b * factor)
             strip.setPixelColor(i, Color(new_r, new_g, new_b))
-        strip.show()
-        time.sleep(delay)
+        show_frame(delay)
     led_off()
 
 
-def gentle_pulse():
+def gentle_pulse(message_id=None):
     """
     Displays a gentle chasing color effect on a 12 LED ring.
     The hue (pink to purple to pink) appears to chase around the ring,
     while all LEDs pulse in unison from dim (0) to bright (255) and back to dim,
     over 256 steps.
+
+    Args:
+        message_id: Id of the pending message, used to trace its first notification frame.
     """
     for j in range(256):
         # Global brightness for all LEDs using a sine wave (0->max->0)
@@ -105,8 +180,9 @@ def gentle_pulse():
             current_colors.append((red, green, blue))
             strip.setPixelColor(i, Color(red, green, blue))
 
-        strip.show()
-        time.sleep(0.02)
+        if j == 0:
+            tracing.record_once(message_id, "first_led_frame")
+        show_frame(0.02)
 
         # Check for state changes; if detected, fade out current colors and exit cycle
         state = read_state()
@@ -165,8 +241,7 @@ def active_pulse():
                     new_b = int(b * brightness_factor)
                     current_colors.append((new_r, new_g, new_b))
                     strip.setPixelColor(i, Color(new_r, new_g, new_b))
-                strip.show()
-                time.sleep(delay)
+                show_frame(delay)
 
                 # Check for state changes during the pulse cycle.
                 state = read_state()
@@ -180,15 +255,13 @@ def active_pulse():
             for i in range(LED_COUNT):
                 r, g, b = base_colors[i]
                 strip.setPixelColor(i, Color(r, g, b))
-            strip.show()
-            time.sleep(on_duration)
+            show_frame(on_duration)
 
             # Turn off LEDs.
             for i in range(LED_COUNT):
                 strip.setPixelColor(i, Color(0, 0, 0))
-            strip.show()
             # Short off interval before the next cycle.
-            time.sleep(0.05)
+            show_frame(0.05)
 
 
 def wifi_not_connected():
@@ -197,8 +270,7 @@ def wifi_not_connected():
     """
     for i in range(LED_COUNT):
         strip.setPixelColor(i, Color(0, 255, 0))
-    strip.show()
-    time.sleep(1)
+    show_frame(1)
 
 
 def nightlight():
@@ -207,8 +279,7 @@ def nightlight():
     """
     for i in range(LED_COUNT):
         strip.setPixelColor(i, Color(255, 75, 00))
-    strip.show()
-    time.sleep(1)
+    show_frame(1)
 
 
 def orange_blink(current_state):
@@ -221,14 +292,12 @@ def orange_blink(current_state):
         # Turn all LEDs orange.
         for j in range(LED_COUNT):
             strip.setPixelColor(j, orange)
-        strip.show()
-        time.sleep(0.1)
+        show_frame(0.1)
 
         # Turn LEDs off between blinks (except after the last blink)
         for j in range(LED_COUNT):
             strip.setPixelColor(j, Color(0, 0, 0))
-        strip.show()
-        time.sleep(0.1)
+        show_frame(0.1)
     current_state["user_input"] = False
     write_state(current_state)
 
@@ -237,7 +306,14 @@ def main():
     """
     Main loop: periodically checks the shared state and updates the LED pattern accordingly.
     """
+    init_strip()
+    show_booting()
+    metrics.set_service("led_display")
+    startup.report()
     while True:
+        loop_start = time.perf_counter()
+        idle_at_start = _frame_timing["idle_seconds"]
+        metrics.flush()
         state = read_state()
         if not state:
             led_off()
@@ -254,16 +330,20 @@ def main():
         elif state.get("message_pending") and state.get("playing"):
             active_pulse()
         elif state.get("message_pending"):
-            gentle_pulse()
+            gentle_pulse(state.get("message_id"))
         else:
             led_off()
+            LOOP_TIME.observe(time.perf_counter() - loop_start - (_frame_timing["idle_seconds"] - idle_at_start))
             time.sleep(0.5)
-        sys.stdout.flush()
+            continue
+        # Leave out the frame delays of the animation this iteration ran.
+        LOOP_TIME.observe(time.perf_counter() - loop_start - (_frame_timing["idle_seconds"] - idle_at_start))
 
 
 if __name__ == "__main__":
     try:
         main()
     except KeyboardInterrupt:
-        led_off()
-        print("LED display interrupted and turned off.")
+        if strip is not None:
+            led_off()
+        log.info("LED display interrupted and turned off.")
@@ -0,0 +1,198 @@
+#!/usr/bin/env python3
+"""
+Message Archive
+
+Content-addressed local store for downloaded messages, shared by the HTTP
+checker (which stores downloads) and the audio player (which plays and replays
+them).
+
+- Audio files live in DOWNLOAD_DIR/objects/<sha256>.<ext>, so identical audio is
+  stored once and filenames can never collide.
+- A compact JSON index (DOWNLOAD_DIR/index.json) maps message ids to objects,
+  ordered by arrival, with a last-used time per message.
+- When the archive grows past ARCHIVE_MAX_BYTES, the least recently used
+  messages are evicted (the newest message is always kept).
+- Index updates from different services are serialized with a lock file. The
+  index is only rewritten when it changed; last-used times are kept to within
+  TOUCH_INTERVAL_SECONDS, so playback rarely costs a write.
+- An unreadable index is rebuilt from the objects on disk rather than
+  overwritten, so the archive never loses track of (and stops evicting) files.
+"""
+
+import os
+import json
+import time
+import fcntl
+import logging
+import threading
+from contextlib import contextmanager
+from monitoring.logs import kv
+
+log = logging.getLogger("vivi.archive")
+
+DOWNLOAD_DIR = "/home/pi/mp3_downloads"  # change as needed
+ARCHIVE_MAX_BYTES = 200 * 1024 * 1024
+INDEX_VERSION = 1
+# Last-used times closer together than this are not worth an index write.
+TOUCH_INTERVAL_SECONDS = 3600
+
+
+def object_path(digest, ext):
+    return os.path.join(DOWNLOAD_DIR, "objects", f"{digest}{ext}")
+
+
+@contextmanager
+def _locked_index():
+    """
+    Lock the index, load it and yield its entries for modification; the entries
+    are saved when the block exits without an error.
+
+    Each entry is a list: [message_id, digest, ext, size, stored_at, last_used].
+    """
+    os.makedirs(DOWNLOAD_DIR, exist_ok=True)
+    with open(os.path.join(DOWNLOAD_DIR, "index.lock"), "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            entries = _read_index()
+            unchanged = json.dumps(entries)
+        except Exception as e:
+            log.error("Error reading archive index, rebuilding it from the objects", extra=kv(error=e))
+            entries = _rebuild_index()
+            unchanged = None
+        yield entries
+        if json.dumps(entries) == unchanged:
+            return
+        index_path = os.path.join(DOWNLOAD_DIR, "index.json")
+        tmp_path = f"{index_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"v": INDEX_VERSION, "entries": entries}, f, separators=(",", ":"))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, index_path)
+
+
+def _read_index():
+    """Return the archive entries, [] if there is no index. Raises if the index is unreadable."""
+    index_path = os.path.join(DOWNLOAD_DIR, "index.json")
+    if not os.path.exists(index_path):
+        return []
+    with open(index_path, "r") as f:
+        return json.load(f)["entries"]
+
+
+def _rebuild_index():
+    """
+    Index every object on disk, oldest first. The message ids are lost, so the
+    entries can still be evicted and replayed, but no longer looked up by id.
+    """
+    objects_dir = os.path.join(DOWNLOAD_DIR, "objects")
+    entries = []
+    if os.path.isdir(objects_dir):
+        for filename in os.listdir(objects_dir):
+            digest, ext = os.path.splitext(filename)
+            stat = os.stat(os.path.join(objects_dir, filename))
+            entries.append([None, digest, ext, stat.st_size, stat.st_mtime, stat.st_mtime])
+    entries.sort(key=lambda e: e[4])
+    return entries
+
+
+def load_index():
+    """Return the archive entries, oldest message first. Returns [] if there is no readable index."""
+    try:
+        return _read_index()
+    except Exception as e:
+        log.error("Error reading archive index", extra=kv(error=e))
+        return []
+
+
+def new_download_path():
+    """Return a temporary path inside the archive to download a message into."""
+    os.makedirs(DOWNLOAD_DIR, exist_ok=True)
+    return os.path.join(DOWNLOAD_DIR, f"download.{os.getpid()}.{threading.get_ident()}.tmp")
+
+
+def _remove_unused_object(entries, entry):
+    """
+    Delete the audio file of an entry that was removed from entries, unless
+    another entry still uses the same audio. Returns whether it was deleted.
+    """
+    digest, ext = entry[1], entry[2]
+    if any(other[1] == digest and other[2] == ext for other in entries):
+        return False
+    try:
+        os.remove(object_path(digest, ext))
+    except FileNotFoundError:
+        pass
+    return True
+
+
+def _evict(entries, keep_message_id):
+    """Remove least recently used entries (and unreferenced objects) until the archive fits its budget."""
+    sizes = {}
+    for entry in entries:
+        sizes[entry[1]] = entry[3]
+    total = sum(sizes.values())
+    for entry in sorted(entries, key=lambda e: e[5]):
+        if total <= ARCHIVE_MAX_BYTES:
+            break
+        if entry[0] == keep_message_id:
+            continue
+        entries.remove(entry)
+        if not _remove_unused_object(entries, entry):
+            continue  # Another message still uses the same audio.
+        total -= entry[3]
+        log.info("Evicted message from archive", extra=kv(message_id=entry[0], bytes=entry[3]))
+
+
+def store(message_id, download_path, digest, ext):
+    """
+    Move a finished download into the archive and index it under message_id.
+
+    Args:
+        message_id: The server-side message id.
+        download_path (str): The downloaded file, e.g. from new_download_path().
+        digest (str): Hex SHA-256 of the file contents.
+        ext (str): File extension including the dot, e.g. ".mp3".
+
+    Returns:
+        str: The archived file path.
+    """
+    path = object_path(digest, ext)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    if os.path.exists(path):
+        os.remove(download_path)  # Same audio already archived.
+    else:
+        os.replace(download_path, path)
+    now = time.time()
+    with _locked_index() as entries:
+        # Replace this message's entry, and a rebuilt entry for the same audio without an id.
+        replaced = [entry for entry in entries if entry[0] == message_id or (entry[0] is None and entry[1] == digest)]
+        entries[:] = [entry for entry in entries if entry not in replaced]
+        entries.append([message_id, digest, ext, os.path.getsize(path), now, now])
+        for entry in replaced:
+            # E.g. a message downloaded again in another format: don't leave its old audio behind.
+            _remove_unused_object(entries, entry)
+        _evict(entries, keep_message_id=message_id)
+    return path
+
+
+def touch(message_id):
+    """Mark a message as just used, so it is evicted last. Entries without an id are left alone."""
+    if message_id is None:
+        return
+    now = time.time()
+    with _locked_index() as entries:
+        for entry in entries:
+            if entry[0] == message_id and now - entry[5] >= TOUCH_INTERVAL_SECONDS:
+                entry[5] = now
+
+
+def recent(count):
+    """Return (message_id, file path) of the last `count` messages received, oldest first."""
+    paths = []
+    for entry in load_index()[-count:]:
+        path = object_path(entry[1], entry[2])
+        if os.path.exists(path):
+            paths.append((entry[0], path))
+    return paths
+
@@ -0,0 +1,165 @@
+#!/usr/bin/env python3
+"""
+Push Channel Client
+
+Keeps one long-lived Server-Sent Events (SSE) connection to the API and queues
+the events it receives ('new_post', 'nightlight'), so the HTTP checker can react
+to new messages immediately instead of polling every few seconds.
+
+- The server is expected to send a keepalive (an SSE comment line) at least every
+  KEEPALIVE_TIMEOUT_SECONDS; a silent connection is treated as dead.
+- Lost or refused connections are retried with exponential backoff (with jitter).
+- While not connected, `connected` is clear and the caller falls back to polling.
+"""
+
+import re
+import json
+import queue
+import random
+import logging
+import threading
+from monitoring import metrics
+from monitoring.logs import kv
+
+log = logging.getLogger("vivi.push_channel")
+
+CONNECT_TIMEOUT_SECONDS = 10
+KEEPALIVE_TIMEOUT_SECONDS = 60
+BACKOFF_INITIAL_SECONDS = 1
+BACKOFF_MAX_SECONDS = 300
+
+PUSH_CONNECTS = metrics.counter("vivi_push_connects_total", "Push channel connection attempts, by result.")
+PUSH_EVENTS = metrics.counter("vivi_push_events_total", "Events received over the push channel, by type.")
+# Event types counted by name; anything else the server sends is counted as "other".
+KNOWN_EVENTS = ("new_post", "nightlight")
+_LINE_END = re.compile(rb"\r\n|\r|\n")
+
+
+def split_lines(chunks):
+    """
+    Split a stream of byte chunks into decoded lines. As the SSE spec requires,
+    CRLF, a lone CR and a lone LF each end one line, even when a CRLF pair is
+    split across two chunks. An unterminated last line is dropped.
+
+    Yields:
+        str: Each line, without its line ending.
+    """
+    buffer = b""
+    skip_lf = False
+    for chunk in chunks:
+        if not chunk:
+            continue
+        if skip_lf and chunk[:1] == b"\n":
+            chunk = chunk[1:]  # Second half of a CRLF whose CR ended the previous chunk.
+        buffer += chunk
+        # A trailing CR already ends a line; a following LF belongs to it.
+        skip_lf = buffer.endswith(b"\r")
+        *lines, buffer = _LINE_END.split(buffer)
+        for line in lines:
+            yield line.decode("utf-8", errors="replace")
+
+
+def parse_sse(lines):
+    """
+    Parse Server-Sent Events from an iterator of decoded lines (see split_lines()).
+
+    Yields:
+        tuple: (event type, data string) for every dispatched event.
+    """
+    event_type = "message"
+    data = []
+    for line in lines:
+        if line is None:
+            continue
+        if line == "":
+            if data:
+                yield event_type, "\n".join(data)
+            event_type = "message"
+            data = []
+            continue
+        if line.startswith(":"):
+            continue  # Comment, used by the server as a keepalive.
+        field, _, value = line.partition(":")
+        if value.startswith(" "):
+            value = value[1:]
+        if field == "event":
+            event_type = value
+        elif field == "data":
+            data.append(value)
+
+
+class PushSubscriber(threading.Thread):
+    """
+    Background thread holding the push connection.
+
+    Received events are available from next_event() as (event type, payload dict).
+    """
+
+    def __init__(self, url):
+        super().__init__(name="push-subscriber", daemon=True)
+        self.url = url
+        self.events = queue.Queue()
+        self.connected = threading.Event()
+        self.stopped = threading.Event()
+        # Incremented on every successful connect, so callers can resync after a gap.
+        self.connections = 0
+
+    def stop(self):
+        self.stopped.set()
+
+    def next_event(self):
+        """Return the next queued (event type, payload) tuple, or None if there is none."""
+        try:
+            return self.events.get_nowait()
+        except queue.Empty:
+            return None
+
+    def _listen(self, session):
+        response = session.get(
+            self.url,
+            stream=True,
+            headers={"Accept": "text/event-stream"},
+            timeout=(CONNECT_TIMEOUT_SECONDS, KEEPALIVE_TIMEOUT_SECONDS),
+        )
+        try:
+            response.raise_for_status()
+            PUSH_CONNECTS.inc(result="ok")
+            self.connections += 1
+            self.connected.set()
+            log.info("Push channel connected", extra=kv(url=self.url))
+            # chunk_size=1 hands over each line as soon as it arrives instead of
+            # waiting for a full buffer; push traffic is tiny, so this is cheap.
+            # Lines are split and decoded (always UTF-8 for SSE) by split_lines(),
+            # as iter_lines() would turn every CRLF into two lines.
+            lines = split_lines(response.iter_content(chunk_size=1))
+            for event_type, data in parse_sse(lines):
+                if self.stopped.is_set():
+                    return
+                try:
+                    payload = json.loads(data) if data else {}
+                except ValueError:
+                    payload = {}
+                PUSH_EVENTS.inc(type=event_type if event_type in KNOWN_EVENTS else "other")
+                self.events.put((event_type, payload))
+        finally:
+            response.close()
+
+    def run(self):
+        import requests
+
+        session = requests.Session()
+        backoff = BACKOFF_INITIAL_SECONDS
+        while not self.stopped.is_set():
+            connections = self.connections
+            try:
+                self._listen(session)
+                log.warning("Push channel closed by server")
+            except Exception as e:
+                PUSH_CONNECTS.inc(result="error")
+                log.warning("Push channel unavailable", extra=kv(url=self.url, error=e))
+            self.connected.clear()
+            if self.connections != connections:
+                backoff = BACKOFF_INITIAL_SECONDS  # The connection worked; retry quickly.
+            delay = backoff * random.uniform(0.5, 1.0)
+            backoff = min(backoff * 2, BACKOFF_MAX_SECONDS)
+            self.stopped.wait(delay)
@@ -10,12 +10,20 @@ Once connectivity is restored (or after the user has submitted new WiFi credenti
 the script stops the captive portal mode.
 """
 
+import time
+from monitoring.startup import StartupTimer
+
+startup = StartupTimer("wifi_manager")
+
 import os
 import subprocess
-import time
-import sys
+from monitoring import metrics
+from monitoring.logs import get_logger, kv
 from state_management.state_management import read_state, write_state
 
+log = get_logger("wifi_manager")
+startup.mark("imports")
+
 # The host to ping to check connectivity (Google DNS is commonly used)
 PING_HOST = "8.8.8.8"
 # How many seconds to wait between checks
@@ -27,6 +35,10 @@ TIMEOUT = 30
 CURRENT_DIR = os.path.dirname(os.path.realpath(__file__))
 CAPTIVE_PORTAL_INSTALL_SCRIPT = os.path.join(CURRENT_DIR, "..", "captive_portal", "install_captive_portal.sh")
 
+LOOP_TIME = metrics.histogram("vivi_loop_iteration_seconds", "Duration of one main loop iteration, excluding the idle sleep.")
+PROBES = metrics.counter("vivi_connectivity_probes_total", "Connectivity probes, by result.")
+PROBE_LATENCY = metrics.histogram("vivi_connectivity_probe_seconds", "Latency of connectivity probes.")
+
 
 def is_connected(host=PING_HOST):
     """
@@ -41,7 +53,7 @@ def is_connected(host=PING_HOST):
         )
         return result.returncode == 0
     except Exception as e:
-        print("Error during ping:", e)
+        log.error("Error during ping", extra=kv(error=e))
         return False
 
 
@@ -50,11 +62,11 @@ def start_captive_portal():
     Launch the captive portal by running the install script.
     This script should set up hostapd, dnsmasq, and start the captive portal web server.
     """
-    print("Starting captive portal mode...")
+    log.warning("Starting captive portal mode...")
     try:
         subprocess.run(["/bin/bash", CAPTIVE_PORTAL_INSTALL_SCRIPT], check=True)
     except subprocess.CalledProcessError as e:
-        print("Failed to start captive portal:", e)
+        log.error("Failed to start captive portal", extra=kv(error=e))
 
 
 def stop_captive_portal():
@@ -62,24 +74,32 @@ def stop_captive_portal():
     Stop the captive portal services.
     This function kills the captive portal web server.
     """
-    print("Stopping captive portal server...")
+    log.info("Stopping captive portal server...")
     try:
         # Kill the captive portal web server process
         subprocess.run(["pkill", "-f", "captive_portal.py"])
     except subprocess.CalledProcessError as e:
-        print("Failed to stop captive portal:", e)
+        log.error("Failed to stop captive portal", extra=kv(error=e))
 
 
 def main():
     disconnect_time = 0
     portal_active = False
 
+    metrics.set_service("wifi_manager")
+    startup.report()
     while True:
+        loop_start = time.perf_counter()
         state = read_state()
-        if is_connected():
-            state["wifi_not_connected"] = False
-            write_state(state)
-            print("Internet connectivity is present.")
+        with PROBE_LATENCY.time():
+            connected = is_connected()
+        PROBES.inc(result="up" if connected else "down")
+        if connected:
+            # Only write when the flag changes, not on every check.
+            if state.get("wifi_not_connected") is not False:
+                state["wifi_not_connected"] = False
+                write_state(state)
+            log.info("Internet connectivity is present.")
             disconnect_time = 0
             if portal_active:
                 # Connectivity restored; disable captive portal mode.
@@ -87,14 +107,15 @@ def main():
                 portal_active = False
         else:
             disconnect_time += CHECK_INTERVAL
-            print(f"Connectivity lost for {disconnect_time} seconds.")
+            log.warning("Connectivity lost", extra=kv(seconds=disconnect_time))
             if disconnect_time >= TIMEOUT and not portal_active:
                 state["wifi_not_connected"] = True
                 write_state(state)
                 start_captive_portal()
                 portal_active = True
+        LOOP_TIME.observe(time.perf_counter() - loop_start)
+        metrics.flush()
         time.sleep(CHECK_INTERVAL)
-        sys.stdout.flush()
 
 
 if __name__ == "__main__":
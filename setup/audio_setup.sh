@@ -2,7 +2,7 @@
 # audio_setup.sh
 # This script sets up the Raspberry Pi for I2S audio output through the MAX98357.
 # It does the following:
-# 1. Installs mpg321 if it is not already installed.
+# 1. Installs mpg321 and opus-tools if they are not already installed.
 # 2. Ensures the I2S interface is enabled.
 # 3. Adds an ALSA configuration file to set the default output device to the I2S DAC.
 # 4. Provides instructions to reboot if necessary.
@@ -16,6 +16,15 @@ else
     echo "mpg321 is already installed."
 fi
 
+# opusdec plays compact Opus messages (piped into aplay).
+if ! command -v opusdec >/dev/null 2>&1; then
+    echo "opusdec not found. Installing opus-tools..."
+    sudo apt-get update
+    sudo apt-get install -y opus-tools
+else
+    echo "opus-tools is already installed."
+fi
+
 # --- Step 1: Enable I2S interface ---
 # On Raspberry Pi OS, the I2S interface is usually enabled by default if you use
 # an appropriate dtoverlay. If not, edit /boot/config.txt and add the following line:
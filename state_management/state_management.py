@@ -3,45 +3,150 @@
 state_management.py - Helper module for managing shared state via a JSON file.
 
 This module provides functions to read, write, and clear a JSON state file.
-The state file is stored in the same directory as this module.
+
+The live state file is kept on tmpfs (RUNTIME_DIR), so the frequent writes of
+transient flags such as 'playing', 'user_input' or 'wifi_not_connected' never
+touch the SD card. Only the durable keys (the current message and whether it
+still has to be played or acknowledged) are checkpointed to the state.json file
+next to this module, and only when they change. After a reboot the live state
+is restored from that checkpoint.
 """
 
 import os
 import json
+import time
+import logging
+import threading
+
+from monitoring import RUNTIME_DIR, metrics
+from monitoring.logs import kv
+
+# Live state, on tmpfs.
+STATE_FILE = os.path.join(RUNTIME_DIR, "state.json")
+# Durable checkpoint, on persistent storage next to this module.
+DURABLE_STATE_FILE = os.path.join(os.path.dirname(os.path.realpath(__file__)), "state.json")
+# Keys that must survive a power cut.
+DURABLE_KEYS = ("message_id", "mp3_path", "message_pending", "message_listened")
+
+log = logging.getLogger("vivi.state")
+
+STATE_IO_LATENCY = metrics.histogram("vivi_state_io_seconds", "Latency of state file reads and writes.")
+STATE_IO_ERRORS = metrics.counter("vivi_state_io_errors_total", "Failed state file reads and writes.")
+
+
+def _write_json(path, data, durable=False):
+    """
+    Atomically replace path with the compact JSON encoding of data. With
+    durable=True the data is fsynced before and after the rename.
+    """
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # Unique per process and thread, so concurrent writers never share a temp file.
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(data, f, separators=(",", ":"))
+        if durable:
+            f.flush()
+            os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+    if durable:
+        dir_fd = os.open(os.path.dirname(path), os.O_RDONLY)
+        try:
+            os.fsync(dir_fd)
+        finally:
+            os.close(dir_fd)
 
-# Define the path to the state.json file relative to this module
-STATE_FILE = os.path.join(os.path.dirname(os.path.realpath(__file__)), "state.json")
+
+def _read_json(path):
+    with open(path, "r") as f:
+        return json.load(f)
+
+
+def read_durable_state():
+    """
+    Read the durable checkpoint. Returns an empty dictionary if there is none.
+    """
+    if not os.path.exists(DURABLE_STATE_FILE):
+        return {}
+    try:
+        state = _read_json(DURABLE_STATE_FILE)
+        return {key: state[key] for key in DURABLE_KEYS if key in state}
+    except Exception as e:
+        STATE_IO_ERRORS.inc(op="checkpoint_read")
+        log.error("Error reading durable state file", extra=kv(error=e))
+        return {}
+
+
+def checkpoint_state(state):
+    """
+    Write the durable keys of the given state to persistent storage, if they
+    differ from the current checkpoint.
+
+    Args:
+        state (dict): The full state.
+    """
+    durable = {key: state[key] for key in DURABLE_KEYS if key in state}
+    if durable == read_durable_state():
+        return
+    start = time.perf_counter()
+    try:
+        _write_json(DURABLE_STATE_FILE, durable, durable=True)
+        STATE_IO_LATENCY.observe(time.perf_counter() - start, op="checkpoint")
+    except Exception as e:
+        STATE_IO_ERRORS.inc(op="checkpoint")
+        log.error("Error writing durable state file", extra=kv(error=e))
+
+
+def restore_state():
+    """
+    Rebuild the live state from the durable checkpoint (e.g. after a reboot
+    emptied tmpfs) and return it.
+    """
+    state = read_durable_state()
+    try:
+        _write_json(STATE_FILE, state)
+        log.info("State restored from checkpoint", extra=kv(state=state))
+    except Exception as e:
+        STATE_IO_ERRORS.inc(op="write")
+        log.error("Error restoring state file", extra=kv(error=e))
+    return state
 
 
 def read_state():
     """
-    Read and return the current state from the state.json file.
-    Returns an empty dictionary if the file does not exist or is empty.
+    Read and return the current state from the live state file.
+    If there is no live state yet, it is restored from the durable checkpoint.
+    Returns an empty dictionary if the file is empty or unreadable.
     """
+    start = time.perf_counter()
     if not os.path.exists(STATE_FILE):
-        return {}
+        return restore_state()
     try:
-        with open(STATE_FILE, "r") as f:
-            state = json.load(f)
+        state = _read_json(STATE_FILE)
+        STATE_IO_LATENCY.observe(time.perf_counter() - start, op="read")
         return state
     except Exception as e:
-        print("Error reading state file:", e)
+        STATE_IO_ERRORS.inc(op="read")
+        log.error("Error reading state file", extra=kv(error=e))
         return {}
 
 
 def write_state(state):
     """
-    Write the provided state dictionary to the state.json file.
+    Write the provided state dictionary to the live state file, and checkpoint
+    its durable keys if they changed.
 
     Args:
         state (dict): The state to write.
     """
+    start = time.perf_counter()
     try:
-        with open(STATE_FILE, "w") as f:
-            json.dump(state, f, indent=4)
-        print("State updated:", state)
+        _write_json(STATE_FILE, state)
+        STATE_IO_LATENCY.observe(time.perf_counter() - start, op="write")
+        log.debug("State updated", extra=kv(state=dict(state)))
     except Exception as e:
-        print("Error writing state file:", e)
+        STATE_IO_ERRORS.inc(op="write")
+        log.error("Error writing state file", extra=kv(error=e))
+    checkpoint_state(state)
 
 
 def clear_state():
@@ -0,0 +1,28 @@
+from scripts.push_channel import parse_sse, split_lines
+
+STREAM = 'event: new_post\ndata: {"id": 1}\n\n: keepalive\n\nevent: nightlight\ndata: {"nightlight": true}\n\n'
+EXPECTED = [("new_post", '{"id": 1}'), ("nightlight", '{"nightlight": true}')]
+
+
+def events(stream, chunk_size):
+    chunks = (stream[i:i + chunk_size] for i in range(0, len(stream), chunk_size))
+    return list(parse_sse(split_lines(chunks)))
+
+
+def test_parse_sse_lf():
+    assert events(STREAM.encode(), 1) == EXPECTED
+    assert events(STREAM.encode(), 1024) == EXPECTED
+
+
+def test_parse_sse_crlf():
+    # Byte by byte, every CRLF is split across two chunks.
+    assert events(STREAM.replace("\n", "\r\n").encode(), 1) == EXPECTED
+    assert events(STREAM.replace("\n", "\r\n").encode(), 1024) == EXPECTED
+
+
+def test_parse_sse_cr():
+    assert events(STREAM.replace("\n", "\r").encode(), 1) == EXPECTED
+
+
+def test_parse_sse_utf8():
+    assert events('data: {"title": "Grüße ☕"}\r\n\r\n'.encode(), 1) == [("message", '{"title": "Grüße ☕"}')]